@@ -3,67 +3,106 @@ Non-Ferrous Metals Real-Time Intelligence Dashboard
 Backend: Flask + yfinance + DuckDuckGo Search + OpenAI-compatible LLM
 """
 
+import asyncio
+import gzip
+import hashlib
 import json
 import logging
+import math
 import os
+import queue
+import random
+import re
+import socket
+import sqlite3
+import threading
 import time
-from datetime import datetime, timedelta
-
-import requests
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import repeat
+from datetime import date, datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+from zoneinfo import ZoneInfo
+
+import httpx
+import numpy as np
 from bs4 import BeautifulSoup
 from ddgs import DDGS
-from flask import Flask, Response, jsonify, render_template, request, stream_with_context
-from openai import OpenAI
+from ddgs.exceptions import DDGSException, RatelimitException
+from ddgs.exceptions import TimeoutException as DDGSTimeout
+from flask import Flask, Response, g, jsonify, render_template, request, stream_with_context
+from openai import OpenAI, RateLimitError
+
+try:
+    import brotli
+except ImportError:  # 可选依赖：未安装时只提供 gzip 压缩
+    brotli = None
+
+try:
+    import orjson
+except ImportError:  # 可选依赖：未安装时使用标准库 json 解析上游响应
+    orjson = None
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.urandom(24).hex()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
 # ---------------------------------------------------------------------------
 # LLM settings (stored in memory; persisted per session)
 # ---------------------------------------------------------------------------
 llm_settings = {
-    "api_key": "",
-    "base_url": "https://api.openai.com/v1",
-    "model": "gpt-4o",
+    "api_key": os.environ.get("LLM_API_KEY", ""),
+    "base_url": os.environ.get("LLM_BASE_URL", "https://api.openai.com/v1"),
+    "model": os.environ.get("LLM_MODEL", "gpt-4o"),
     "temperature": 0.7,
 }
 
 # ---------------------------------------------------------------------------
-# Commodity ticker mappings for different data sources
+# Instrument registry – ticker per data source for each element
 # ---------------------------------------------------------------------------
-
-# Yahoo Finance futures symbols
-YAHOO_TICKERS = {
-    "Au": "GC=F",      # Gold Futures
-    "Ag": "SI=F",      # Silver Futures
-    "Cu": "HG=F",      # Copper Futures
-    "Pt": "PL=F",      # Platinum Futures
-    "Pd": "PA=F",      # Palladium Futures
-    "Al": "ALI=F",     # Aluminum Futures
+# instruments.json: {"Au": {"name": "Gold", "sources": {"yahoo_finance": "GC=F", ...}}, ...}
+# sources 的顺序即该元素的数据源优先级；未列出的元素直接返回 unsupported，不请求任何上游
+INSTRUMENTS_PATH = os.environ.get(
+    "INSTRUMENTS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "instruments.json"))
+PRICE_SOURCE_NAMES = {
+    "yahoo_finance": "Yahoo Finance",   # 期货价格 (日线写入本地历史库)
+    "alpha_vantage": "Alpha Vantage",   # 需要 API key
+    "metal_etf":     "Metal ETF",       # 金属 ETF / ETN
+    "mining_stock":  "Mining Stock",    # 矿业、冶炼公司股价 (含 A 股、澳股等代理)
 }
+PRICE_SOURCES = list(PRICE_SOURCE_NAMES)
 
-# Alternative: Metal ETF symbols for spot prices
-ETF_TICKERS = {
-    "Au": "GLD",       # SPDR Gold Shares
-    "Ag": "SLV",       # iShares Silver Trust
-    "Cu": "CPER",      # Copper ETF
-    "Pt": "PPLT",      # Platinum ETF
-    "Pd": "PALL",      # Palladium ETF
-    "Al": "JJUB",      # Aluminum ETF (Invesco DB)
-}
 
-# Fallback: Stock ticker symbols for mining companies
-STOCK_TICKERS = {
-    "Au": "NEM",       # Newmont Corporation
-    "Ag": "SLW",       # Silver Wheaton
-    "Cu": "FCX",       # Freeport-McMoRan
-    "Pt": "SIBN.L",    # Sibanye-Stillwater
-    "Pd": "SIBN.L",    # Sibanye-Stillwater
-    "Al": "ACH",       # Aluminum Corp of China
-}
+def _load_instruments(path: str) -> dict[str, dict]:
+    with open(path, encoding="utf-8") as f:
+        raw = json.load(f)
+    instruments = {}
+    for symbol, spec in raw.items():
+        sources = spec.get("sources") or {}
+        unknown = set(sources) - set(PRICE_SOURCE_NAMES)
+        if unknown:
+            raise ValueError(f"{path}: unknown price sources for {symbol}: {sorted(unknown)}")
+        instruments[symbol] = {"name": spec.get("name", symbol), "sources": dict(sources)}
+    return instruments
+
+
+INSTRUMENTS = _load_instruments(INSTRUMENTS_PATH)
+
+
+def _source_tickers(source: str) -> dict[str, str]:
+    """symbol -> 该数据源的代码"""
+    return {sym: spec["sources"][source] for sym, spec in INSTRUMENTS.items() if source in spec["sources"]}
+
+
+# 有期货报价的金属 (本地历史、技术指标与跨金属矩阵基于这些金属)
+YAHOO_TICKERS = _source_tickers("yahoo_finance")
 
 # ---------------------------------------------------------------------------
 # Metal metadata – search keywords per news category
@@ -77,45 +116,829 @@ METAL_SEARCH_TEMPLATES = {
     "supply":     "{metal} supply chain smelting refinery inventory",
 }
 
-# Simple in-memory cache:  key -> (timestamp, data)
-_cache: dict[str, tuple[float, object]] = {}
+# 新闻索引后台采集的金属 (与前端 name_en 一致) 及语言
+METAL_NAMES = {sym: spec["name"] for sym, spec in INSTRUMENTS.items()}
+NEWS_LANGS = ("en", "zh")
+
 CACHE_TTL = 300  # 5 minutes
+# LLM 调用排队: 进程内最多排队的请求数与最长等待秒数；
+# LLM_SHARED_CONCURRENCY > 0 且 CACHE_BACKEND=sqlite 时另设所有 worker 共享的并发上限
+LLM_QUEUE_MAX = int(os.environ.get("LLM_QUEUE_MAX", "8"))
+LLM_QUEUE_TIMEOUT = int(os.environ.get("LLM_QUEUE_TIMEOUT", "60"))
+LLM_SHARED_CONCURRENCY = int(os.environ.get("LLM_SHARED_CONCURRENCY", "0"))
+LLM_SLOT_TTL = 300  # 共享槽位租约有效期 (秒)，worker 异常退出后自动释放
+# 429 重试次数与单次最长退避秒数
+LLM_MAX_RETRIES = 3
+LLM_MAX_BACKOFF = 30
+# 每次 LLM 调用的提示词 token 预算 (可按模型覆盖，JSON: {"gpt-4o-mini": 4000})
+LLM_PROMPT_BUDGET = int(os.environ.get("LLM_PROMPT_BUDGET", "6000"))
+LLM_PROMPT_BUDGETS = json.loads(os.environ.get("LLM_PROMPT_BUDGETS", "{}"))
+# LLM 响应缓存的最长有效期 (秒)；关联的新闻缓存条目更早过期时以其为准
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", "3600"))
+# 上游确认不存在的代码 (如已退市) 在该秒数内不再请求对应数据源
+NEGATIVE_CACHE_TTL = int(os.environ.get("NEGATIVE_CACHE_TTL", str(6 * 3600)))
+
+# 按键前缀区分的 (软过期, 硬过期) 秒数:
+# 软过期后仍立即返回旧值并在后台刷新一次，硬过期后才在请求线程中同步获取
+CACHE_POLICIES = {
+    "price": (300, 1800),
+    "news":  (600, 3600),
+    "quotes": (60, 600),
+    "indicators": (60, 600),
+    "llm":   (LLM_CACHE_TTL, LLM_CACHE_TTL),
+    "neg":   (NEGATIVE_CACHE_TTL, NEGATIVE_CACHE_TTL),
+}
+CACHE_REFRESH_WORKERS = 4
+
+# 缓存后端: "memory" (进程内，默认) 或 "sqlite" (同一主机上所有 worker 共享)
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "memory")
+DATA_DIR = os.environ.get("NF_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+CACHE_DB_PATH = os.environ.get("CACHE_DB_PATH", os.path.join(DATA_DIR, "cache.db"))
+# 跨 worker 加载租约的有效期 (秒)，持有租约的 worker 负责请求上游
+LOAD_LEASE_TTL = 30
+# 只应由一个 worker 执行的后台任务 (新闻采集、预取) 的租约库，与缓存后端无关
+WORKER_LEASE_DB_PATH = os.environ.get("WORKER_LEASE_DB_PATH", os.path.join(DATA_DIR, "leases.db"))
+
+# 缓存容量上限 (条目数 / 近似字节数) 与过期条目清理间隔
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "2000"))
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_SWEEP_INTERVAL = 60
+
+# 本地新闻索引 (去重后的文章及其 symbol/category/lang 标签)
+NEWS_DB_PATH = os.environ.get("NEWS_DB_PATH", os.path.join(DATA_DIR, "news.db"))
+NEWS_INGEST_INTERVAL = int(os.environ.get("NEWS_INGEST_INTERVAL", "1800"))  # 后台采集周期 (秒)
+NEWS_INDEX_MAX_AGE = 2 * NEWS_INGEST_INTERVAL  # 超过该时间未采集的组合回退到实时搜索
+# 后台只采集最近 NEWS_DEMAND_TTL 秒内有用户查看过的组合，每轮最多 NEWS_INGEST_MAX_QUERIES 次搜索
+NEWS_DEMAND_TTL = 24 * 3600
+NEWS_INGEST_MAX_QUERIES = int(os.environ.get("NEWS_INGEST_MAX_QUERIES", "24"))
+NEWS_PAGE_SIZE = 12
+NEWS_SEARCH_MAX_PAGE = 1000   # 搜索接口允许的最大页码，避免超大 OFFSET 溢出 SQLite 整数
+
+# 后台预取: 交易时段内每 PREFETCH_INTERVAL 秒、休市时每 PREFETCH_CLOSED_INTERVAL 秒刷新一轮
+# 所有金属的价格与默认分类新闻，各请求在前 PREFETCH_SPREAD 比例的周期内随机错开
+PREFETCH_ENABLED = os.environ.get("PREFETCH_ENABLED", "1") != "0"
+PREFETCH_INTERVAL = int(os.environ.get("PREFETCH_INTERVAL", "240"))
+PREFETCH_CLOSED_INTERVAL = int(os.environ.get("PREFETCH_CLOSED_INTERVAL", "1500"))
+PREFETCH_SPREAD = 0.25
+MARKET_TZ = ZoneInfo("America/New_York")
+
+# 本地 OHLC 历史数据库 (按 symbol/source/date 存储日线)
+HISTORY_DB_PATH = os.environ.get("HISTORY_DB_PATH", os.path.join(DATA_DIR, "history.db"))
+# 走势图可选的时间范围 -> 天数
+HISTORY_RANGES = {"1mo": 31, "3mo": 92, "6mo": 183, "1y": 366, "2y": 731, "5y": 1827}
+DEFAULT_HISTORY_RANGE = "1mo"
+
+# 批量价格接口的并发线程数 (上游请求为 I/O 密集型)
+PRICE_FETCH_WORKERS = int(os.environ.get("PRICE_FETCH_WORKERS", "8"))
+MAX_BATCH_SYMBOLS = 32
+_price_executor = ThreadPoolExecutor(max_workers=PRICE_FETCH_WORKERS, thread_name_prefix="price")
 
 # Alpha Vantage API key (free tier: 5 requests per minute, 500 per day)
 # 用户需要自己申请免费 API Key: https://www.alphavantage.co/support/#api-key
 ALPHA_VANTAGE_API_KEY = os.environ.get("ALPHA_VANTAGE_API_KEY", "")
-
-# 数据源优先级顺序
-PRICE_SOURCES = [
-    "yahoo_finance",    # 首选: Yahoo Finance (期货价格)
-    "alpha_vantage",    # 备选1: Alpha Vantage (需要API key)
-    "metal_etf",        # 备选2: Metal ETF价格
-    "mining_stock",     # 备选3: 矿业公司股价
-]
-
-# Persistent HTTP session for Yahoo Finance
-_yf_session = requests.Session()
-_yf_session.headers["User-Agent"] = (
+AV_REQUESTS_PER_MINUTE = int(os.environ.get("AV_REQUESTS_PER_MINUTE", "5"))
+AV_REQUESTS_PER_DAY = int(os.environ.get("AV_REQUESTS_PER_DAY", "500"))
+AV_PRIORITY_RESERVE = 1     # 每分钟为用户正在查看的符号保留的请求数
+AV_PRIORITY_MAX_WAIT = 5    # 正在查看的符号最多排队等待令牌的秒数
+AV_VIEW_TTL = 300           # 单个价格接口被访问后的 N 秒内视为"正在查看"
+# outputsize=full 是付费接口；免费版只请求 compact (最近100个交易日)
+AV_PREMIUM = os.environ.get("AV_PREMIUM", "0") == "1"
+
+# 数据源熔断: 连续失败 N 次后熔断，冷却后放行一次探测请求 (half-open)
+CIRCUIT_FAILURE_THRESHOLD = 3
+CIRCUIT_COOLDOWN = 60           # 秒
+HEALTH_WINDOW = 20              # 滚动健康评分统计最近 N 次调用
+HEALTH_MAX_AGE = 300            # 超过该秒数的调用结果不再计入评分 (降级的数据源会被重新尝试)
+HEALTH_MIN_SUCCESS_RATE = 0.5   # 低于该成功率的数据源排到健康数据源之后
+# Yahoo 请求超时 (读取 10 秒, 连接 3 秒)
+YAHOO_TIMEOUT = httpx.Timeout(10, connect=3.05)
+
+# 上游地址 (可指向本地回放服务器，用于离线基准测试)
+YAHOO_BASE_URL = os.environ.get("YAHOO_BASE_URL", "https://query1.finance.yahoo.com")
+YAHOO_COOKIE_URL = os.environ.get("YAHOO_COOKIE_URL", "https://fc.yahoo.com")
+AV_BASE_URL = os.environ.get("AV_BASE_URL", "https://www.alphavantage.co")
+# 设置后新闻改为请求该 JSON 搜索接口 (?q=&max_results=，返回与 DDGS news 相同字段的列表)，不再使用 DDGS
+NEWS_SEARCH_URL = os.environ.get("NEWS_SEARCH_URL", "")
+
+# Yahoo 多代码批量报价接口 (spark 接口与 chart 结构相同，且无需 crumb)
+YAHOO_QUOTE_URL = f"{YAHOO_BASE_URL}/v7/finance/spark"
+YAHOO_SPARK_MAX_SYMBOLS = 20  # 单次 spark 请求的代码数上限
+
+YAHOO_USER_AGENT = (
     "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
     "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
 )
-# Warm cookie
-try:
-    _yf_session.get("https://fc.yahoo.com", timeout=5)
-except Exception:
-    pass
+
+# 各上游的最大并发数 (超出的调用立即失败，不占用请求线程排队)
+# 阻塞式上游 (DDGS、LLM) 的调用期间仍占用请求线程：DDGS_CONCURRENCY + LLM_CONCURRENCY + LLM_QUEUE_MAX
+# 应明显小于 GUNICORN_THREADS，为价格接口留出线程
+UPSTREAM_LIMITS = {
+    "yahoo":         int(os.environ.get("YAHOO_CONCURRENCY", "64")),
+    "alpha_vantage": 4,
+    "ddgs":          int(os.environ.get("DDGS_CONCURRENCY", "4")),
+    "llm":           int(os.environ.get("LLM_CONCURRENCY", "8")),
+}
+
+# 上游故障注入 (离线压测降级场景用)，JSON: {"yahoo": {"latency": 2, "error_rate": 0.3, "error_status": 503}}
+# 可用字段见 FaultInjector；设置 FAULT_ADMIN_TOKEN 后可经 /api/admin/faults 运行时修改
+FAULT_INJECTION = json.loads(os.environ.get("FAULT_INJECTION", "{}"))
+FAULT_ADMIN_TOKEN = os.environ.get("FAULT_ADMIN_TOKEN", "")
+
+
+# ---------------------------------------------------------------------------
+#  Metrics
+# ---------------------------------------------------------------------------
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class _Metric:
+    """Prometheus 文本格式的计数器 / 直方图 (按标签值分组，进程内统计)"""
+
+    def __init__(self, name: str, help_: str, labels: tuple[str, ...], kind: str, buckets: tuple = ()):
+        self.name, self.help, self.labels, self.kind, self.buckets = name, help_, labels, kind, buckets
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _series(self, labels: dict) -> list:
+        key = tuple(str(labels.get(l, "")) for l in self.labels)
+        series = self._values.get(key)
+        if series is None:
+            # 计数器: [value]；直方图: [各桶计数..., +Inf 计数, sum]
+            series = self._values[key] = [0.0] * (len(self.buckets) + 2 if self.kind == "histogram" else 1)
+        return series
+
+    def inc(self, amount: float = 1, **labels):
+        with self._lock:
+            self._series(labels)[0] += amount
+
+    def observe(self, value: float, **labels):
+        with self._lock:
+            series = self._series(labels)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        for key, series in items:
+            label_str = ",".join(f'{l}="{v}"' for l, v in zip(self.labels, key))
+            if self.kind == "counter":
+                lines.append(f"{self.name}{{{label_str}}} {series[0]}")
+                continue
+            sep = "," if label_str else ""
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{label_str}{sep}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label_str}{sep}le="+Inf"}} {series[-2]}')
+            lines.append(f"{self.name}_count{{{label_str}}} {series[-2]}")
+            lines.append(f"{self.name}_sum{{{label_str}}} {series[-1]}")
+        return lines
+
+
+_metrics: list[_Metric] = []
+
+_m_request_latency = _Metric(
+    "nf_http_request_duration_seconds", "HTTP request latency until response headers, by route.",
+    ("route", "method", "status"), "histogram", LATENCY_BUCKETS)
+_m_upstream_latency = _Metric(
+    "nf_upstream_duration_seconds", "Upstream call latency by upstream and outcome.",
+    ("upstream", "outcome"), "histogram", LATENCY_BUCKETS)
+_m_upstream_errors = _Metric(
+    "nf_upstream_errors_total", "Failed upstream calls.", ("upstream",), "counter")
+_m_retries = _Metric(
+    "nf_upstream_retries_total", "Retried or fallback upstream calls.", ("upstream", "reason"), "counter")
+_m_llm_ttft = _Metric(
+    "nf_llm_time_to_first_token_seconds", "Time from LLM request start to the first streamed token.",
+    ("endpoint",), "histogram", LATENCY_BUCKETS)
+
+
+@contextmanager
+def _timed(upstream: str):
+    """记录一次上游调用的耗时与成败"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        _m_upstream_latency.observe(time.perf_counter() - start, upstream=upstream, outcome="error")
+        _m_upstream_errors.inc(upstream=upstream)
+        raise
+    _m_upstream_latency.observe(time.perf_counter() - start, upstream=upstream, outcome="ok")
+
+
+# ---------------------------------------------------------------------------
+#  Fault Injection
+# ---------------------------------------------------------------------------
+class FaultInjector:
+    """按上游注入延迟与故障，用于离线复现上游降级时的重试、回退与尾延迟
+
+    每个上游 (UPSTREAM_LIMITS 中的名称) 可配置:
+      latency / latency_rate   以该概率在响应前增加 latency 秒 (超过请求超时则按超时处理)
+      drop_rate                断开连接
+      error_rate / error_status / retry_after   返回 429 或 5xx
+      malformed_rate           返回无法解析的 JSON
+    HTTP 上游 (Yahoo / Alpha Vantage / LLM) 在 httpx 传输层注入，DDGS 在每次调用前注入。
+    """
+
+    DEFAULTS = {
+        "latency": 0.0, "latency_rate": 1.0, "drop_rate": 0.0,
+        "error_rate": 0.0, "error_status": 503, "retry_after": 1, "malformed_rate": 0.0,
+    }
+
+    def __init__(self, config: dict):
+        self._lock = threading.Lock()
+        self._config: dict[str, dict] = {}
+        self.configure(config)
+
+    @classmethod
+    def validate(cls, config: dict) -> dict[str, dict]:
+        if not isinstance(config, dict):
+            raise ValueError("fault config must be an object keyed by upstream")
+        parsed = {}
+        for upstream, spec in config.items():
+            if upstream not in UPSTREAM_LIMITS:
+                raise ValueError(f"unknown upstream: {upstream}")
+            if not isinstance(spec, dict):
+                raise ValueError(f"{upstream}: expected an object")
+            unknown = set(spec) - set(cls.DEFAULTS)
+            if unknown:
+                raise ValueError(f"{upstream}: unknown fields {sorted(unknown)}")
+            fault = {k: type(v)(spec.get(k, v)) for k, v in cls.DEFAULTS.items()}
+            rates = [fault[k] for k in ("latency_rate", "drop_rate", "error_rate", "malformed_rate")]
+            if any(r < 0 or r > 1 for r in rates) or sum(rates[1:]) > 1:
+                raise ValueError(f"{upstream}: rates must be within 0..1 and failure rates sum to at most 1")
+            if fault["latency"] < 0 or not 400 <= fault["error_status"] <= 599:
+                raise ValueError(f"{upstream}: latency must be >= 0 and error_status a 4xx/5xx code")
+            parsed[upstream] = fault
+        return parsed
+
+    def configure(self, config: dict):
+        parsed = self.validate(config)
+        with self._lock:
+            self._config = parsed
+        if parsed:
+            logger.warning(f"Fault injection enabled for: {', '.join(sorted(parsed))}")
+
+    def config(self) -> dict[str, dict]:
+        with self._lock:
+            return {k: dict(v) for k, v in self._config.items()}
+
+    def draw(self, upstream: str) -> tuple[float, str | None, dict]:
+        """为一次调用抽取 (延迟秒数, 故障类型, 配置)；未配置时延迟为 0、故障为 None"""
+        fault = self._config.get(upstream)
+        if fault is None:
+            return 0.0, None, {}
+        delay = fault["latency"] if fault["latency"] and random.random() < fault["latency_rate"] else 0.0
+        r, kind = random.random(), None
+        for name, field in (("drop", "drop_rate"), ("error", "error_rate"), ("malformed", "malformed_rate")):
+            if r < fault[field]:
+                kind = name
+                break
+            r -= fault[field]
+        if delay:
+            _m_faults.inc(upstream=upstream, fault="latency")
+        if kind:
+            _m_faults.inc(upstream=upstream, fault=kind)
+        return delay, kind, fault
+
+    @staticmethod
+    def _read_timeout(request: httpx.Request) -> float | None:
+        return (request.extensions.get("timeout") or {}).get("read")
+
+    @staticmethod
+    def _response(kind: str, fault: dict, request: httpx.Request) -> httpx.Response:
+        if kind == "drop":
+            raise httpx.RemoteProtocolError("Server disconnected without sending a response (injected)", request=request)
+        if kind == "error":
+            status = fault["error_status"]
+            headers = {"retry-after": str(fault["retry_after"])} if status == 429 else {}
+            return httpx.Response(status, headers=headers, request=request,
+                                  json={"error": {"message": f"Injected HTTP {status}", "code": status}})
+        try:
+            streaming = bool(json.loads(request.content or b"{}").get("stream"))
+        except (ValueError, AttributeError, httpx.RequestNotRead):
+            streaming = False
+        if streaming:
+            return httpx.Response(200, headers={"content-type": "text/event-stream"}, request=request,
+                                  content=b'data: {"id": "injected", "choices": [{"delta": \n\n')
+        return httpx.Response(200, headers={"content-type": "application/json"}, request=request,
+                              content=b'{"chart": {"result": [{"meta": ')
+
+    def before_call(self, upstream: str, timeout: float | None = None):
+        """阻塞式 SDK (DDGS) 调用前注入：按配置等待后抛出对应异常"""
+        delay, kind, fault = self.draw(upstream)
+        if timeout is not None and delay >= timeout:
+            time.sleep(timeout)
+            raise DDGSTimeout(f"Injected timeout after {timeout}s")
+        time.sleep(delay)
+        if kind == "drop":
+            raise DDGSTimeout("Injected fault: connection dropped")
+        if kind == "error":
+            if fault["error_status"] == 429:
+                raise RatelimitException("Injected fault: 429 Ratelimit")
+            raise DDGSException(f"Injected fault: HTTP {fault['error_status']}")
+        if kind == "malformed":
+            raise DDGSException("Injected fault: malformed response")
+
+
+class FaultTransport(httpx.BaseTransport):
+    """同步 httpx 传输层包装 (LLM 客户端)"""
+
+    def __init__(self, upstream: str, transport: httpx.BaseTransport):
+        self.upstream, self._transport = upstream, transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        delay, kind, fault = _faults.draw(self.upstream)
+        timeout = _faults._read_timeout(request)
+        if timeout is not None and delay >= timeout:
+            time.sleep(timeout)
+            raise httpx.ReadTimeout("Injected timeout", request=request)
+        time.sleep(delay)
+        if kind:
+            return _faults._response(kind, fault, request)
+        return self._transport.handle_request(request)
+
+    def close(self):
+        self._transport.close()
+
+
+class AsyncFaultTransport(httpx.AsyncBaseTransport):
+    """异步 httpx 传输层包装 (UpstreamIO)；上游名称由请求的 extensions["upstream"] 指定"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        delay, kind, fault = _faults.draw(request.extensions.get("upstream", ""))
+        timeout = _faults._read_timeout(request)
+        if timeout is not None and delay >= timeout:
+            await asyncio.sleep(timeout)
+            raise httpx.ReadTimeout("Injected timeout", request=request)
+        await asyncio.sleep(delay)
+        if kind:
+            return _faults._response(kind, fault, request)
+        return await self._transport.handle_async_request(request)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+_m_faults = _Metric("nf_injected_faults_total", "Injected upstream faults.", ("upstream", "fault"), "counter")
+_faults = FaultInjector(FAULT_INJECTION)
+
+
+# ---------------------------------------------------------------------------
+#  Upstream I/O
+# ---------------------------------------------------------------------------
+class UpstreamBusy(Exception):
+    """上游并发已达上限 (调用方立即失败，接口返回 503)"""
+
+
+class UpstreamIO:
+    """上游 I/O 层
+
+    HTTP 上游 (Yahoo / Alpha Vantage) 在一个后台 asyncio 事件循环上经共享的
+    httpx.AsyncClient 连接池发出；阻塞式 SDK (DDGS、OpenAI 流) 通过 ``limit()`` 计数。
+    请求线程在调用期间仍等待结果，因此超过 UPSTREAM_LIMITS 的调用不排队，
+    直接抛出 UpstreamBusy，避免某个上游变慢时耗尽所有请求线程。
+    """
+
+    def __init__(self, limits: dict[str, int]):
+        self.limits = limits
+        self._blocking = {name: threading.BoundedSemaphore(n) for name, n in limits.items()}
+        self._in_flight = {name: 0 for name in limits}
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._pid = None
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        # 首次使用时启动 (fork 后重新启动)，导入时不产生线程或网络 I/O
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="upstream-io", daemon=True).start()
+                asyncio.run_coroutine_threadsafe(self._setup(), loop).result()
+                self._loop, self._pid = loop, os.getpid()
+            return self._loop
+
+    async def _setup(self):
+        total = sum(self.limits.values())
+        transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(max_connections=total, max_keepalive_connections=total),
+        )
+        self._client = httpx.AsyncClient(
+            headers={"User-Agent": YAHOO_USER_AGENT},
+            transport=AsyncFaultTransport(transport),
+            follow_redirects=True,
+        )
+        self._semaphores = {name: asyncio.Semaphore(n) for name, n in self.limits.items()}
+
+    def _track(self, upstream: str, delta: int):
+        with self._lock:
+            self._in_flight[upstream] += delta
+
+    async def request(self, upstream: str, method: str, url: str, **kwargs) -> httpx.Response:
+        # 检查与获取之间没有 await，在事件循环线程上是原子的
+        if self._semaphores[upstream].locked():
+            raise UpstreamBusy(f"Too many concurrent {upstream} calls, try again later")
+        async with self._semaphores[upstream]:
+            self._track(upstream, 1)
+            start = time.perf_counter()
+            outcome = "error"
+            try:
+                resp = await self._client.request(method, url, extensions={"upstream": upstream}, **kwargs)
+                outcome = "ok" if resp.status_code < 400 else "error"
+                return resp
+            finally:
+                self._track(upstream, -1)
+                _m_upstream_latency.observe(time.perf_counter() - start, upstream=f"http_{upstream}", outcome=outcome)
+                if outcome == "error":
+                    _m_upstream_errors.inc(upstream=f"http_{upstream}")
+
+    def get(self, upstream: str, url: str, **kwargs) -> httpx.Response:
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self.request(upstream, "GET", url, **kwargs), loop).result()
+
+    @contextmanager
+    def limit(self, upstream: str):
+        """阻塞式上游调用的并发限制 (不等待)"""
+        sem = self._blocking[upstream]
+        if not sem.acquire(blocking=False):
+            raise UpstreamBusy(f"Too many concurrent {upstream} calls, try again later")
+        self._track(upstream, 1)
+        try:
+            yield
+        finally:
+            self._track(upstream, -1)
+            sem.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {name: {"limit": n, "in_flight": self._in_flight[name]} for name, n in self.limits.items()}
+
+
+_upstream = UpstreamIO(UPSTREAM_LIMITS)
+_yf_cookie_warmed = False
+
+
+def _yf_get(url: str, params: dict) -> httpx.Response:
+    """经共享连接池请求 Yahoo Finance (首次调用时先获取 cookie)"""
+    global _yf_cookie_warmed
+    if not _yf_cookie_warmed:
+        _yf_cookie_warmed = True
+        try:
+            _upstream.get("yahoo", YAHOO_COOKIE_URL, timeout=5)
+        except Exception:
+            pass
+    return _upstream.get("yahoo", url, params=params, timeout=YAHOO_TIMEOUT)
+
+
+# ---------------------------------------------------------------------------
+#  Cache
+# ---------------------------------------------------------------------------
+_sqlite_local = threading.local()
+
+
+def _sqlite_conn(path: str) -> sqlite3.Connection:
+    """每个线程一个 SQLite 连接 (autocommit, WAL 模式)；fork 后 (gunicorn --preload) 自动重建"""
+    if getattr(_sqlite_local, "pid", None) != os.getpid():
+        _sqlite_local.conns, _sqlite_local.pid = {}, os.getpid()
+    conn = _sqlite_local.conns.get(path)
+    if conn is None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _sqlite_local.conns[path] = conn
+    return conn
+
+
+def _approx_size(data) -> int:
+    """按 JSON 序列化长度估算缓存值占用的字节数"""
+    try:
+        return len(json.dumps(data))
+    except (TypeError, ValueError):
+        return 1024
+
+
+class MemoryCacheBackend:
+    """进程内 LRU 缓存:  key -> (timestamp, data)
+
+    条目数或近似字节数超过上限时淘汰最久未访问的条目。
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data: OrderedDict[str, tuple[float, object, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            self._data.move_to_end(key)
+            return entry[0], entry[1]
+
+    def set(self, key: str, ts: float, data):
+        size = _approx_size(data)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._data[key] = (ts, data, size)
+            self._bytes += size
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+
+    def keys(self) -> list[str]:
+        with self._lock:
+            return list(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def sweep(self, is_expired) -> int:
+        """删除 ``is_expired(key, ts)`` 为真的条目，返回删除数量"""
+        with self._lock:
+            expired = [k for k, (ts, _, _) in self._data.items() if is_expired(k, ts)]
+            for k in expired:
+                self._bytes -= self._data.pop(k)[2]
+            self.expirations += len(expired)
+        return len(expired)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def try_lease(self, key: str, ttl: float) -> bool:
+        # 单进程内的并发已由 _inflight 合并
+        return True
+
+    def release(self, key: str):
+        pass
+
+
+class SQLiteCacheBackend:
+    """SQLite (WAL 模式) 共享缓存，同一主机上的所有 gunicorn worker 读写同一个文件
+
+    值以 JSON 存储；清除操作直接作用于共享表，因此对所有 worker 立即生效。
+    """
+
+    def __init__(self, path: str, max_entries: int, max_bytes: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self.expirations = 0
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, ts REAL, data TEXT)")
+        conn.execute("CREATE TABLE IF NOT EXISTS cache_leases (key TEXT PRIMARY KEY, expires REAL)")
+
+    def _conn(self) -> sqlite3.Connection:
+        return _sqlite_conn(self.path)
+
+    def get(self, key: str):
+        row = self._conn().execute("SELECT ts, data FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def set(self, key: str, ts: float, data):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO cache (key, ts, data) VALUES (?, ?, ?)",
+            (key, ts, json.dumps(data, ensure_ascii=False)),
+        )
+
+    def delete(self, key: str):
+        self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def keys(self) -> list[str]:
+        return [row[0] for row in self._conn().execute("SELECT key FROM cache")]
+
+    def clear(self):
+        self._conn().execute("DELETE FROM cache")
+
+    def sweep(self, is_expired) -> int:
+        """删除过期条目，并按写入时间淘汰超出条目数或字节数上限的部分 (计数为本进程所做的清理)"""
+        conn = self._conn()
+        expired = [(k,) for k, ts in conn.execute("SELECT key, ts FROM cache") if is_expired(k, ts)]
+        conn.executemany("DELETE FROM cache WHERE key = ?", expired)
+        self.expirations += len(expired)
+        overflow = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            conn.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY ts LIMIT ?)", (overflow,))
+            self.evictions += overflow
+        # 从最新的条目起累计大小，超出字节上限的较旧条目全部淘汰
+        cur = conn.execute(
+            "DELETE FROM cache WHERE key IN (SELECT key FROM ("
+            " SELECT key, SUM(LENGTH(data)) OVER (ORDER BY ts DESC, key) AS running FROM cache"
+            ") WHERE running > ?)",
+            (self.max_bytes,),
+        )
+        self.evictions += max(cur.rowcount, 0)
+        return len(expired)
+
+    def stats(self) -> dict:
+        entries, size = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM cache").fetchone()
+        return {
+            "entries": entries,
+            "bytes": size,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def try_lease(self, key: str, ttl: float) -> bool:
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM cache_leases WHERE key = ? AND expires < ?", (key, now))
+            cur = conn.execute("INSERT OR IGNORE INTO cache_leases (key, expires) VALUES (?, ?)", (key, now + ttl))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return cur.rowcount == 1
+
+    def release(self, key: str):
+        self._conn().execute("DELETE FROM cache_leases WHERE key = ?", (key,))
+
+
+def _create_cache_backend():
+    if CACHE_BACKEND == "sqlite":
+        logger.info(f"Using shared SQLite cache at {CACHE_DB_PATH}")
+        return SQLiteCacheBackend(CACHE_DB_PATH, CACHE_MAX_ENTRIES, CACHE_MAX_BYTES)
+    return MemoryCacheBackend(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES)
+
+
+_cache = _create_cache_backend()
+
+# 缓存命中统计 (本进程)
+_cache_stats = {"hits": 0, "stale_hits": 0, "misses": 0}
+_cache_stats_lock = threading.Lock()
+
+
+def _record_cache(event: str):
+    with _cache_stats_lock:
+        _cache_stats[event] += 1
 
 
 def _cache_get(key: str):
-    if key in _cache:
-        ts, data = _cache[key]
-        if time.time() - ts < CACHE_TTL:
+    entry = _cache.get(key)
+    if entry is not None:
+        ts, data = entry
+        if time.time() - ts < _cache_policy(key)[0]:
+            _record_cache("hits")
             return data
+    _record_cache("misses")
     return None
 
 
 def _cache_set(key: str, data):
-    _cache[key] = (time.time(), data)
+    _cache.set(key, time.time(), data)
+
+
+def _cache_policy(key: str) -> tuple[float, float]:
+    return CACHE_POLICIES.get(key.split(":", 1)[0], (CACHE_TTL, CACHE_TTL))
+
+
+def _cache_expired(key: str, ts: float) -> bool:
+    return time.time() - ts >= _cache_policy(key)[1]
+
+
+def _cache_sweeper():
+    """定期清理硬过期的缓存条目"""
+    while True:
+        time.sleep(CACHE_SWEEP_INTERVAL)
+        try:
+            removed = _cache.sweep(_cache_expired)
+            if removed:
+                logger.info(f"Cache sweeper removed {removed} expired entries")
+        except Exception as e:
+            logger.warning(f"Cache sweep failed: {e}")
+
+
+# 正在进行中的上游加载:  key -> Future (用于合并并发请求)
+_inflight: dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+_refresh_executor = ThreadPoolExecutor(max_workers=CACHE_REFRESH_WORKERS, thread_name_prefix="cache-refresh")
+
+
+def _claim_load(key: str) -> tuple[Future, bool]:
+    """返回该键的加载 Future；第二个值表示调用者是否负责执行加载"""
+    with _inflight_lock:
+        fut = _inflight.get(key)
+        if fut is not None:
+            return fut, False
+        fut = Future()
+        _inflight[key] = fut
+        return fut, True
+
+
+def _run_load(key: str, loader, fut: Future, accept=None, stale=None):
+    """执行加载并写入缓存；若其他 worker 持有该键的租约，则等待其结果"""
+    leased = False
+    try:
+        leased = _cache.try_lease(key, LOAD_LEASE_TTL)
+        if not leased:
+            if stale is not None:
+                # 后台刷新已由其他 worker 负责
+                fut.set_result(stale)
+                return
+            started = time.time()
+            while time.time() - started < LOAD_LEASE_TTL:
+                time.sleep(0.1)
+                entry = _cache.get(key)
+                if entry is not None and entry[0] >= started:
+                    fut.set_result(entry[1])
+                    return
+                leased = _cache.try_lease(key, LOAD_LEASE_TTL)
+                if leased:
+                    break
+        data = loader()
+        if accept is None or accept(data):
+            _cache_set(key, data)
+        fut.set_result(data)
+    except Exception as e:
+        fut.set_exception(e)
+    finally:
+        if leased:
+            _cache.release(key)
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+def _cache_fetch(key: str, loader, accept=None):
+    """Stale-while-revalidate 读取
+
+    - 软过期内: 直接返回缓存
+    - 软过期后、硬过期前: 返回旧值，同时在后台刷新 (同一键只刷新一次)
+    - 未命中或硬过期: 同步加载；并发的相同请求只会触发一次上游调用
+    ``accept(data)`` 返回 False 时结果不写入缓存 (例如获取失败的价格)。
+    """
+    entry = _cache.get(key)
+    if entry is not None:
+        ts, data = entry
+        age = time.time() - ts
+        soft_ttl, hard_ttl = _cache_policy(key)
+        if age < soft_ttl:
+            _record_cache("hits")
+            return data
+        if age < hard_ttl:
+            _record_cache("stale_hits")
+            fut, owner = _claim_load(key)
+            if owner:
+                _refresh_executor.submit(_run_load, key, loader, fut, accept, data)
+            return data
+
+    _record_cache("misses")
+    fut, owner = _claim_load(key)
+    if owner:
+        _run_load(key, loader, fut, accept)
+    return fut.result()
+
+
+def _cache_prefetch(key: str, loader, accept=None, min_age: float = 0.0) -> bool:
+    """后台预取：条目不存在或已超过 min_age 秒时在当前线程加载并写入缓存
+
+    与用户请求共用进行中的加载 (同一键只请求一次上游)；其他 worker 持有租约时直接跳过。
+    返回是否执行了加载。
+    """
+    entry = _cache.get(key)
+    if entry is not None and time.time() - entry[0] < min_age:
+        return False
+    fut, owner = _claim_load(key)
+    if owner:
+        _run_load(key, loader, fut, accept, entry[1] if entry is not None else None)
+    fut.result()
+    return owner
 
 
 def _format_error(symbol: str, source: str, error_msg: str) -> dict:
@@ -128,6 +951,173 @@ def _format_error(symbol: str, source: str, error_msg: str) -> dict:
     }
 
 
+# ---------------------------------------------------------------------------
+#  Background services
+# ---------------------------------------------------------------------------
+_background_started = False
+_background_lock = threading.Lock()
+
+
+def start_background_services():
+    """启动后台线程 (可重复调用)
+
+    由 gunicorn 的 post_worker_init 钩子 (gunicorn.conf.py) 或 ``python app.py`` 在应用就绪后调用；
+    导入模块时不启动线程也不产生网络 I/O (兼容 gunicorn --preload)。
+    """
+    global _background_started
+    if _background_started:
+        return
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+        threading.Thread(target=_cache_sweeper, name="cache-sweeper", daemon=True).start()
+        threading.Thread(target=_price_poller, name="price-poller", daemon=True).start()
+        threading.Thread(target=_news_ingester, name="news-ingester", daemon=True).start()
+        if PREFETCH_ENABLED:
+            threading.Thread(target=_prefetcher, name="prefetcher", daemon=True).start()
+
+
+def _hold_worker_lease(name: str, ttl: float) -> bool:
+    """取得或续期后台任务的租约，返回本进程是否为该任务的执行者
+
+    租约保存在 WORKER_LEASE_DB_PATH，同一主机上的所有 worker 共享 (与缓存后端无关)。
+    持有者每轮续期，任务因此固定由一个 worker 执行；该 worker 退出后租约在 ``ttl`` 秒后过期，由其他 worker 接手。
+    """
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    now = time.time()
+    conn = _sqlite_conn(WORKER_LEASE_DB_PATH)
+    conn.execute("CREATE TABLE IF NOT EXISTS worker_leases (name TEXT PRIMARY KEY, owner TEXT, expires REAL)")
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM worker_leases WHERE name = ? AND expires < ?", (name, now))
+        conn.execute(
+            "INSERT OR IGNORE INTO worker_leases (name, owner, expires) VALUES (?, ?, ?)", (name, owner, now + ttl)
+        )
+        held = conn.execute(
+            "UPDATE worker_leases SET expires = ? WHERE name = ? AND owner = ?", (now + ttl, name, owner)
+        ).rowcount == 1
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return held
+
+
+@app.before_request
+def _start_background_services():
+    """其他启动方式 (如 flask run) 下在首个请求到达时启动后台线程"""
+    if not _background_started:
+        start_background_services()
+
+
+# ---------------------------------------------------------------------------
+#  HTTP – compression & conditional requests
+# ---------------------------------------------------------------------------
+COMPRESS_MIN_SIZE = 512
+COMPRESS_MIMETYPES = {
+    "application/json", "text/html", "text/css", "text/plain",
+    "application/javascript", "text/javascript", "image/svg+xml",
+}
+# 带 ETag 的接口，客户端可用 If-None-Match 获得 304
+ETAG_PATH_PREFIXES = ("/api/price/", "/api/news/")
+# 响应体含每次不同的字段 (elapsed_ms)，ETag 永远不会匹配
+ETAG_EXCLUDED_PATHS = ("/api/news/search",)
+STATIC_COMPRESS_CACHE_SIZE = 64
+
+# 已压缩的静态文件: (path, etag, encoding) -> bytes
+_static_compressed: OrderedDict = OrderedDict()
+_static_compressed_lock = threading.Lock()
+
+
+def _choose_encoding() -> str | None:
+    accept = request.accept_encodings
+    if brotli is not None and accept["br"]:
+        return "br"
+    if accept["gzip"]:
+        return "gzip"
+    return None
+
+
+def _compress(data: bytes, encoding: str, static: bool) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if static else 5)
+    return gzip.compress(data, compresslevel=9 if static else 6, mtime=0)
+
+
+def _compress_static(response, encoding: str) -> bytes:
+    """静态文件内容不变，按 ETag 缓存压缩结果，避免每次请求重复压缩"""
+    key = (request.path, response.get_etag()[0], encoding)
+    with _static_compressed_lock:
+        body = _static_compressed.get(key)
+        if body is not None:
+            _static_compressed.move_to_end(key)
+            return body
+    body = _compress(response.get_data(), encoding, static=True)
+    with _static_compressed_lock:
+        _static_compressed[key] = body
+        while len(_static_compressed) > STATIC_COMPRESS_CACHE_SIZE:
+            _static_compressed.popitem(last=False)
+    return body
+
+
+@app.errorhandler(UpstreamBusy)
+def _upstream_busy(e):
+    """上游并发已满且没有可用缓存时返回 503，客户端稍后重试"""
+    return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def _record_request_latency(response):
+    """按路由模板 (而非原始路径) 统计请求耗时；流式响应只计到响应头发出"""
+    start = g.get("request_start")
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        _m_request_latency.observe(
+            time.perf_counter() - start, route=route, method=request.method, status=response.status_code
+        )
+    return response
+
+
+@app.after_request
+def _finalize_response(response):
+    """为价格/新闻接口添加 ETag (支持 304)，并按 Accept-Encoding 压缩 JSON 与静态资源"""
+    if (request.method == "GET" and response.status_code == 200 and response.mimetype == "application/json"
+            and request.path.startswith(ETAG_PATH_PREFIXES) and request.path not in ETAG_EXCLUDED_PATHS):
+        # 弱 ETag：同一内容的 gzip / br / 未压缩版本视为等价
+        response.set_etag(hashlib.sha1(response.get_data()).hexdigest(), weak=True)
+        response.make_conditional(request)
+
+    if (response.status_code != 200 or response.mimetype not in COMPRESS_MIMETYPES
+            or "Content-Encoding" in response.headers):
+        return response
+    static = request.endpoint == "static"
+    if response.is_streamed and not static:
+        return response  # SSE 等流式响应不压缩
+    response.vary.add("Accept-Encoding")
+    encoding = _choose_encoding()
+    if encoding is None:
+        return response
+
+    if static:
+        response.direct_passthrough = False
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # 静态文件的强 ETag 只对应未压缩的字节；压缩后改为弱 ETag
+        response.set_etag(etag, weak=True)
+    response.set_data(_compress_static(response, encoding) if static else _compress(data, encoding, static=False))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
 # ---------------------------------------------------------------------------
 #  Routes – Pages
 # ---------------------------------------------------------------------------
@@ -137,104 +1127,694 @@ def index():
 
 
 # ---------------------------------------------------------------------------
-#  Price Data Sources
+#  OHLC History Store
 # ---------------------------------------------------------------------------
+_history_schema_pid = None
+
+
+def _history_db() -> sqlite3.Connection:
+    global _history_schema_pid
+    conn = _sqlite_conn(HISTORY_DB_PATH)
+    if _history_schema_pid != os.getpid():
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS bars ("
+            " symbol TEXT, source TEXT, date TEXT,"
+            " open REAL, high REAL, low REAL, close REAL, volume INTEGER,"
+            " PRIMARY KEY (symbol, source, date))"
+        )
+        # 已完整回填的最早日期 (请求更长范围时才需要重新回填)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS backfill ("
+            " symbol TEXT, source TEXT, since TEXT, PRIMARY KEY (symbol, source))"
+        )
+        _history_schema_pid = os.getpid()
+    return conn
 
-def _fetch_yahoo_finance(symbol: str, ticker: str) -> dict:
-    """从 Yahoo Finance 获取期货价格"""
-    logger.info(f"[Yahoo Finance] Fetching {symbol} ({ticker})")
-    
-    url = f"https://query1.finance.yahoo.com/v8/finance/chart/{ticker}"
-    params = {"range": "1mo", "interval": "1d"}
-    
-    max_retries = 3
-    for attempt in range(max_retries):
+
+def _history_since(range_: str) -> str:
+    days = HISTORY_RANGES.get(range_, HISTORY_RANGES[DEFAULT_HISTORY_RANGE])
+    return (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+def _history_last_date(symbol: str, source: str, since: str) -> str | None:
+    """若本地已回填到 ``since``，返回最后一根日线的日期；否则返回 None (需要完整回填)"""
+    conn = _history_db()
+    row = conn.execute("SELECT since FROM backfill WHERE symbol = ? AND source = ?", (symbol, source)).fetchone()
+    if row is None or row[0] > since:
+        return None
+    row = conn.execute("SELECT MAX(date) FROM bars WHERE symbol = ? AND source = ?", (symbol, source)).fetchone()
+    return row[0]
+
+
+def _history_store(symbol: str, source: str, bars: list[tuple], backfilled_since: str | None = None):
+    """写入 (date, open, high, low, close, volume) 日线，已存在的日期会被覆盖"""
+    conn = _history_db()
+    conn.execute("BEGIN")
+    try:
+        conn.executemany(
+            "INSERT OR REPLACE INTO bars (symbol, source, date, open, high, low, close, volume)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(symbol, source, *bar) for bar in bars],
+        )
+        if backfilled_since:
+            conn.execute(
+                "INSERT INTO backfill (symbol, source, since) VALUES (?, ?, ?)"
+                " ON CONFLICT (symbol, source) DO UPDATE SET since = MIN(since, excluded.since)",
+                (symbol, source, backfilled_since),
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _history_load(symbol: str, source: str, since: str) -> list[tuple]:
+    return _history_db().execute(
+        "SELECT date, open, high, low, close, volume FROM bars"
+        " WHERE symbol = ? AND source = ? AND date >= ? ORDER BY date",
+        (symbol, source, since),
+    ).fetchall()
+
+
+def _price_from_bars(symbol: str, ticker: str, source: str, bars: list[tuple], currency: str = "USD") -> dict:
+    """由本地日线构建价格响应 (最新价、涨跌与走势图历史)"""
+    if not bars:
+        raise Exception("No valid price data available")
+    date, open_, high, low, price, volume = bars[-1]
+    prev_price = bars[-2][4] if len(bars) > 1 else price
+    change = price - prev_price
+    change_pct = (change / prev_price) * 100 if prev_price else 0
+
+    history = [{
+        "date": d,
+        "open": round(o or 0, 2),
+        "high": round(h or 0, 2),
+        "low": round(l or 0, 2),
+        "close": round(c, 2),
+        "volume": int(v or 0),
+    } for d, o, h, l, c, v in bars]
+
+    return {
+        "symbol": symbol,
+        "ticker": ticker,
+        "available": True,
+        "source": source,
+        "price": round(price, 2),
+        "change": round(change, 2),
+        "change_pct": round(change_pct, 2),
+        "currency": currency,
+        "high": round(high or price, 2),
+        "low": round(low or price, 2),
+        "open": round(open_ or price, 2),
+        "volume": int(volume or 0),
+        "date": date,
+        "history": history,
+    }
+
+
+_EPOCH = datetime(1970, 1, 1).date()
+
+
+def _history_columnar(history: list[dict]) -> dict:
+    """把逐日 dict 列表转换为列式结构：日期为相对 ``start_day`` (epoch 日) 的偏移"""
+    days = [(datetime.strptime(h["date"], "%Y-%m-%d").date() - _EPOCH).days for h in history]
+    start = min(days) if days else 0
+    return {
+        "start_day": start,
+        "day": [d - start for d in days],
+        "open": [h["open"] for h in history],
+        "high": [h["high"] for h in history],
+        "low": [h["low"] for h in history],
+        "close": [h["close"] for h in history],
+        "volume": [h["volume"] for h in history],
+    }
+
+
+# ---------------------------------------------------------------------------
+#  Technical Indicators
+# ---------------------------------------------------------------------------
+INDICATOR_SMA_WINDOWS = (20, 50, 200)
+INDICATOR_VOL_WINDOW = 20       # 滚动波动率窗口 (交易日)
+INDICATOR_RSI_PERIOD = 14
+INDICATOR_ATR_PERIOD = 14
+INDICATOR_CORR_WINDOW = 90      # 跨金属相关系数使用最近 N 个交易日的收益率
+DEFAULT_INDICATOR_RANGE = "1y"
+TRADING_DAYS = 252
+
+
+def _indicator_panel(range_: str) -> tuple[list[str], list[str], dict[str, np.ndarray]]:
+    return _history_panel(_history_since(range_))
+
+
+def _history_panel(since: str) -> tuple[list[str], list[str], dict[str, np.ndarray]]:
+    """读取所有金属 ``since`` (含) 之后的本地日线并按日期对齐为 (金属 × 日期) 矩阵，缺失值为 NaN
+
+    只读取 yahoo_finance 期货日线：ETF / 股票价格与期货不可比，不能混入同一矩阵。
+    """
+    conn = _history_db()
+    present = {symbol for (symbol,) in conn.execute(
+        "SELECT DISTINCT symbol FROM bars WHERE source = 'yahoo_finance' AND date >= ?", (since,)
+    )}
+    symbols = [s for s in YAHOO_TICKERS if s in present]
+    rows = {s: _history_load(s, "yahoo_finance", since) for s in symbols}
+    dates = sorted({r[0] for bars in rows.values() for r in bars})
+    col = {d: i for i, d in enumerate(dates)}
+
+    fields = {name: np.full((len(symbols), len(dates)), np.nan) for name in ("open", "high", "low", "close")}
+    for i, s in enumerate(symbols):
+        if not rows[s]:
+            continue
+        idx = np.fromiter((col[r[0]] for r in rows[s]), dtype=np.intp, count=len(rows[s]))
+        values = np.array([r[1:5] for r in rows[s]], dtype=float)
+        for j, name in enumerate(("open", "high", "low", "close")):
+            fields[name][i, idx] = values[:, j]
+    return symbols, dates, fields
+
+
+def _ffill(a: np.ndarray) -> np.ndarray:
+    """沿日期轴向前填充 NaN (停牌或各市场假日不同)"""
+    idx = np.where(np.isnan(a), 0, np.arange(a.shape[1]))
+    np.maximum.accumulate(idx, axis=1, out=idx)
+    return a[np.arange(a.shape[0])[:, None], idx]
+
+
+def _rolling_mean(a: np.ndarray, window: int) -> np.ndarray:
+    out = np.full(a.shape, np.nan)
+    if a.shape[1] >= window:
+        c = np.cumsum(np.nan_to_num(a), axis=1)
+        c = np.concatenate([np.zeros((a.shape[0], 1)), c], axis=1)
+        out[:, window - 1:] = (c[:, window:] - c[:, :-window]) / window
+        # 窗口内含 NaN 的位置置为 NaN
+        n = np.cumsum(np.isnan(a), axis=1)
+        n = np.concatenate([np.zeros((a.shape[0], 1)), n], axis=1)
+        out[:, window - 1:][(n[:, window:] - n[:, :-window]) > 0] = np.nan
+    return out
+
+
+def _wilder(a: np.ndarray, period: int) -> np.ndarray:
+    """Wilder 平滑 (alpha = 1/period)，以每个金属前 period 个有效值的均值为起点
+
+    递推 y_t = y_{t-1} + (x_t - y_{t-1}) / period 按块展开为累积和，块长受浮点范围限制，
+    避免逐日的 Python 循环。起点之后的输入不应含 NaN (收盘价已向前填充)。
+    """
+    out = np.full(a.shape, np.nan)
+    beta = 1 - 1 / period
+    block = 128
+    powers = beta ** np.arange(1, block + 1)
+    for i, row in enumerate(a):
+        valid = np.flatnonzero(~np.isnan(row))
+        if valid.size < period:
+            continue
+        seed = valid[period - 1]
+        y = row[valid[:period]].mean()
+        out[i, seed] = y
+        x = row[seed + 1:]
+        for start in range(0, x.size, block):
+            xb = x[start:start + block]
+            p = powers[:xb.size]
+            seg = p * (y + np.cumsum(xb / p) / period)
+            out[i, seed + 1 + start:seed + 1 + start + xb.size] = seg
+            y = seg[-1]
+    return out
+
+
+def _compute_indicators(fields: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """对 (金属 × 日期) 矩阵一次性计算所有指标"""
+    close = _ffill(fields["close"])
+    high = np.where(np.isnan(fields["high"]), close, fields["high"])
+    low = np.where(np.isnan(fields["low"]), close, fields["low"])
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        log_ret = np.full(close.shape, np.nan)
+        log_ret[:, 1:] = np.diff(np.log(close), axis=1)
+
+        out = {f"sma_{w}": _rolling_mean(close, w) for w in INDICATOR_SMA_WINDOWS}
+        mean = _rolling_mean(log_ret, INDICATOR_VOL_WINDOW)
+        mean_sq = _rolling_mean(log_ret ** 2, INDICATOR_VOL_WINDOW)
+        var = np.maximum(mean_sq - mean ** 2, 0) * INDICATOR_VOL_WINDOW / (INDICATOR_VOL_WINDOW - 1)
+        out["volatility"] = np.sqrt(var * TRADING_DAYS)
+
+        change = np.full(close.shape, np.nan)
+        change[:, 1:] = np.diff(close, axis=1)
+        # 保留首个收盘价之前的 NaN，_wilder 从前 period 个真实涨跌开始计算初值
+        gain = _wilder(np.where(change > 0, change, np.where(np.isnan(change), np.nan, 0.0))[:, 1:],
+                       INDICATOR_RSI_PERIOD)
+        loss = _wilder(np.where(change < 0, -change, np.where(np.isnan(change), np.nan, 0.0))[:, 1:],
+                       INDICATOR_RSI_PERIOD)
+        rsi = np.full(close.shape, np.nan)
+        rsi[:, 1:] = np.where(loss == 0, 100.0, 100 - 100 / (1 + gain / loss))
+        out["rsi"] = rsi
+
+        prev_close = np.concatenate([close[:, :1], close[:, :-1]], axis=1)
+        true_range = np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+        out["atr"] = _wilder(true_range, INDICATOR_ATR_PERIOD)
+
+        out["drawdown"] = close / np.fmax.accumulate(close, axis=1) - 1
+    out["close"] = close
+    out["log_return"] = log_ret
+    return out
+
+
+def _correlations(log_ret: np.ndarray) -> np.ndarray:
+    """最近 INDICATOR_CORR_WINDOW 个交易日收益率的相关系数矩阵 (仅使用各金属都有数据的日期)"""
+    window = log_ret[:, -INDICATOR_CORR_WINDOW:]
+    window = window[:, ~np.isnan(window).any(axis=0)]
+    if window.shape[1] < 3:
+        return np.full((log_ret.shape[0], log_ret.shape[0]), np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.corrcoef(window)
+
+
+def _num(x, digits: int = 4):
+    return None if x is None or not np.isfinite(x) else round(float(x), digits)
+
+
+def _indicator_summary(range_: str) -> dict:
+    """所有金属的最新指标值与相关系数 (可缓存的 JSON 结构)"""
+    start = time.perf_counter()
+    symbols, dates, fields = _indicator_panel(range_)
+    ind = _compute_indicators(fields) if dates else {}
+    corr = _correlations(ind["log_return"]) if dates else None
+
+    metals = {}
+    for i, s in enumerate(symbols):
+        valid = np.flatnonzero(~np.isnan(fields["close"][i]))
+        if valid.size == 0:
+            continue
+        t = valid[-1]
+        metals[s] = {
+            "as_of": dates[t],
+            "bars": int(valid.size),
+            "close": _num(ind["close"][i, t], 2),
+            **{f"sma_{w}": _num(ind[f"sma_{w}"][i, t], 2) for w in INDICATOR_SMA_WINDOWS},
+            "volatility": _num(ind["volatility"][i, t]),
+            "rsi": _num(ind["rsi"][i, t], 2),
+            "atr": _num(ind["atr"][i, t], 2),
+            "drawdown": _num(ind["drawdown"][i, t]),
+            "max_drawdown": _num(np.nanmin(ind["drawdown"][i, :t + 1])),
+            "correlations": {o: _num(corr[i, j]) for j, o in enumerate(symbols) if j != i},
+        }
+    return {
+        "range": range_,
+        "metals": metals,
+        "compute_ms": round((time.perf_counter() - start) * 1000, 2),
+    }
+
+
+def _get_indicators(range_: str) -> dict:
+    return _cache_fetch(f"indicators:{range_}", lambda: _indicator_summary(range_))
+
+
+def _indicator_series(symbol: str, range_: str) -> dict | None:
+    """单个金属的完整指标时间序列 (用于绘图)"""
+    symbols, dates, fields = _indicator_panel(range_)
+    if symbol not in symbols:
+        return None
+    i = symbols.index(symbol)
+    ind = _compute_indicators(fields)
+    names = ["close", *(f"sma_{w}" for w in INDICATOR_SMA_WINDOWS), "volatility", "rsi", "atr", "drawdown"]
+    return {"dates": dates, **{n: [_num(v) for v in ind[n][i]] for n in names}}
+
+
+def _indicator_prompt(symbol: str) -> str:
+    """供 AI 分析使用的结构化指标文本；本地没有该金属的日线时返回空字符串"""
+    m = _get_indicators(DEFAULT_INDICATOR_RANGE)["metals"].get(symbol)
+    if not m:
+        return ""
+    corr = ", ".join(f"{o} {c:+.2f}" for o, c in m["correlations"].items() if c is not None)
+    return (
+        f"- As of {m['as_of']} ({m['bars']} daily bars): close {m['close']}, "
+        f"SMA20 {m['sma_20']}, SMA50 {m['sma_50']}, SMA200 {m['sma_200']}\n"
+        f"- RSI(14) {m['rsi']}, ATR(14) {m['atr']}, annualised volatility (20d) {m['volatility']}\n"
+        f"- Drawdown from high {m['drawdown']}, max drawdown {m['max_drawdown']}\n"
+        f"- {INDICATOR_CORR_WINDOW}-day return correlations: {corr or 'N/A'}"
+    )
+
+
+# ---------------------------------------------------------------------------
+#  Price Source Health (circuit breaker)
+# ---------------------------------------------------------------------------
+class SourceHealth:
+    """单个价格数据源的熔断器与滚动健康评分"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probing = False
+        self.outcomes: deque[tuple[float, bool, float]] = deque(maxlen=HEALTH_WINDOW)
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            # 冷却结束后只放行一个探测请求
+            if time.time() - self.opened_at >= CIRCUIT_COOLDOWN and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record(self, ok: bool, latency: float):
+        with self._lock:
+            self.outcomes.append((time.time(), ok, latency))
+            self.probing = False
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+            else:
+                self.failures += 1
+                if self.failures >= CIRCUIT_FAILURE_THRESHOLD:
+                    if self.opened_at is None:
+                        logger.warning(f"Circuit opened for source {self.name}")
+                    self.opened_at = time.time()
+
+    def cancel_probe(self):
+        with self._lock:
+            self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.time() - self.opened_at >= CIRCUIT_COOLDOWN:
+            return "half_open"
+        return "open"
+
+    def _recent(self) -> list[tuple[float, bool, float]]:
+        cutoff = time.time() - HEALTH_MAX_AGE
+        return [o for o in list(self.outcomes) if o[0] >= cutoff]
+
+    @property
+    def success_rate(self) -> float:
+        recent = self._recent()
+        if not recent:
+            return 1.0
+        return sum(ok for _, ok, _ in recent) / len(recent)
+
+    @property
+    def avg_latency(self) -> float:
+        recent = self._recent()
+        if not recent:
+            return 0.0
+        return sum(lat for _, _, lat in recent) / len(recent)
+
+    def score(self) -> float:
+        """成功率越高、延迟越低，得分越高"""
+        return self.success_rate / (1 + self.avg_latency)
+
+    def snapshot(self) -> dict:
+        return {
+            "source": self.name,
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "success_rate": round(self.success_rate, 3),
+            "avg_latency_ms": round(self.avg_latency * 1000, 1),
+            "score": round(self.score(), 4),
+        }
+
+
+_source_health = {source: SourceHealth(source) for source in PRICE_SOURCES}
+
+
+def _ordered_sources(sources: list[str] = PRICE_SOURCES) -> list[str]:
+    """健康的数据源保持配置的优先级，不健康的按得分排在其后"""
+    healthy = [s for s in sources if _source_health[s].success_rate >= HEALTH_MIN_SUCCESS_RATE]
+    degraded = [s for s in sources if s not in healthy]
+    return healthy + sorted(degraded, key=lambda s: _source_health[s].score(), reverse=True)
+
+
+class SourceSkipped(Exception):
+    """数据源被主动跳过 (熔断或额度不足)，不计入健康评分"""
+
+
+class InstrumentNotFound(Exception):
+    """上游确认该代码不存在 (如已退市)；数据源本身正常，结果写入负缓存"""
+
+
+def _call_source(source: str, fetch):
+    """经熔断器调用数据源，并记录结果与耗时"""
+    health = _source_health[source]
+    if not health.allow():
+        raise SourceSkipped("Skipped (circuit open)")
+    start = time.perf_counter()
+    try:
+        result = fetch()
+    except (SourceSkipped, UpstreamBusy):
+        # 未真正调用数据源 (或被本地并发上限拒绝)，不计入熔断统计
+        health.cancel_probe()
+        raise
+    except InstrumentNotFound:
+        health.record(True, time.perf_counter() - start)
+        raise
+    except Exception:
+        health.record(False, time.perf_counter() - start)
+        _m_upstream_latency.observe(time.perf_counter() - start, upstream=source, outcome="error")
+        _m_upstream_errors.inc(upstream=source)
+        raise
+    health.record(True, time.perf_counter() - start)
+    _m_upstream_latency.observe(time.perf_counter() - start, upstream=source, outcome="ok")
+    return result
+
+
+# ---------------------------------------------------------------------------
+#  Alpha Vantage Request Budget
+# ---------------------------------------------------------------------------
+class RequestBudget:
+    """令牌桶 (每分钟) + 每日配额
+
+    CACHE_BACKEND=sqlite 时状态保存在共享数据库中，所有 worker 共用同一份额度。
+    非优先请求不排队，并为正在查看的符号保留 ``AV_PRIORITY_RESERVE`` 个令牌。
+    """
+
+    def __init__(self, name: str, per_minute: int, per_day: int, db_path: str | None = None):
+        self.name = name
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.per_day = per_day
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._state = self._initial_state()
+        self._viewed: dict[str, float] = {}
+        if db_path:
+            _sqlite_conn(db_path).execute(
+                "CREATE TABLE IF NOT EXISTS budgets ("
+                " name TEXT PRIMARY KEY, tokens REAL, updated REAL, day TEXT, used_today INTEGER)"
+            )
+
+    def _initial_state(self) -> dict:
+        return {"tokens": float(self.capacity), "updated": time.time(),
+                "day": datetime.utcnow().strftime("%Y-%m-%d"), "used_today": 0}
+
+    def _transact(self, fn):
+        """在锁 (或 SQLite 事务) 中读取、修改并写回状态"""
+        if not self.db_path:
+            with self._lock:
+                self._refill(self._state)
+                return fn(self._state)
+        conn = _sqlite_conn(self.db_path)
+        conn.execute("BEGIN IMMEDIATE")
         try:
-            resp = _yf_session.get(url, params=params, timeout=15)
-            if resp.status_code == 200 and resp.text:
-                data = resp.json()
-                
-                chart = data.get("chart", {})
-                if chart.get("error"):
-                    error_desc = chart["error"].get("description", "Unknown API error")
-                    raise Exception(f"API Error: {error_desc}")
-                
-                result_data = chart.get("result", [{}])[0]
-                if not result_data:
-                    raise Exception("No data returned from API")
-                    
-                meta = result_data.get("meta", {})
-                timestamps = result_data.get("timestamp", [])
-                indicators = result_data.get("indicators", {})
-                quotes = indicators.get("quote", [{}])[0]
-
-                if not timestamps or not quotes.get("close"):
-                    raise Exception("Missing required data fields")
+            row = conn.execute(
+                "SELECT tokens, updated, day, used_today FROM budgets WHERE name = ?", (self.name,)
+            ).fetchone()
+            state = dict(zip(("tokens", "updated", "day", "used_today"), row)) if row else self._initial_state()
+            self._refill(state)
+            result = fn(state)
+            conn.execute(
+                "INSERT OR REPLACE INTO budgets (name, tokens, updated, day, used_today) VALUES (?, ?, ?, ?, ?)",
+                (self.name, state["tokens"], state["updated"], state["day"], state["used_today"]),
+            )
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _refill(self, state: dict):
+        now = time.time()
+        state["tokens"] = min(self.capacity, state["tokens"] + (now - state["updated"]) * self.rate)
+        state["updated"] = now
+        today = datetime.utcnow().strftime("%Y-%m-%d")
+        if state["day"] != today:
+            state["day"], state["used_today"] = today, 0
+
+    def try_acquire(self, priority: bool = False) -> float:
+        """取得令牌返回 0；否则返回需要等待的秒数 (今日额度用完时为 inf)"""
+        reserve = 0 if priority else AV_PRIORITY_RESERVE
+
+        def take(state):
+            if state["used_today"] >= self.per_day:
+                return math.inf
+            if state["tokens"] >= 1 + reserve:
+                state["tokens"] -= 1
+                state["used_today"] += 1
+                return 0.0
+            return (1 + reserve - state["tokens"]) / self.rate
+
+        return self._transact(take)
+
+    def acquire(self, priority: bool = False, max_wait: float = AV_PRIORITY_MAX_WAIT) -> bool:
+        """优先请求在 ``max_wait`` 秒内排队等待令牌，其他请求立即返回"""
+        deadline = time.time() + (max_wait if priority else 0)
+        while True:
+            wait = self.try_acquire(priority)
+            if wait == 0:
+                return True
+            if time.time() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def drain(self, day: bool = False):
+        """上游已返回限流提示时清空额度 (例如同一 API Key 被其他程序使用)"""
+        def empty(state):
+            state["tokens"] = 0.0
+            if day:
+                state["used_today"] = self.per_day
+        self._transact(empty)
+
+    def mark_viewed(self, symbol: str):
+        now = time.time()
+        with self._lock:
+            # 清理过期记录，避免字典随请求中的任意符号无限增长
+            for sym in [s for s, t in self._viewed.items() if now - t >= AV_VIEW_TTL]:
+                del self._viewed[sym]
+            self._viewed[symbol] = now
+
+    def is_viewed(self, symbol: str) -> bool:
+        return time.time() - self._viewed.get(symbol, 0) < AV_VIEW_TTL
+
+    def snapshot(self) -> dict:
+        state = self._transact(dict)
+        return {
+            "remaining_minute": int(state["tokens"]),
+            "remaining_day": max(0, self.per_day - state["used_today"]),
+            "per_minute": self.capacity,
+            "per_day": self.per_day,
+            "shared": bool(self.db_path),
+        }
+
+
+_av_budget = RequestBudget(
+    "alpha_vantage",
+    AV_REQUESTS_PER_MINUTE,
+    AV_REQUESTS_PER_DAY,
+    CACHE_DB_PATH if CACHE_BACKEND == "sqlite" else None,
+)
+
+
+# ---------------------------------------------------------------------------
+#  Yahoo chart decoding
+# ---------------------------------------------------------------------------
+_json_loads = orjson.loads if orjson is not None else json.loads
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
 
-                closes = quotes["close"]
-                opens = quotes.get("open", closes)
-                highs = quotes.get("high", closes)
-                lows = quotes.get("low", closes)
-                volumes = quotes.get("volume", [0] * len(closes))
 
-                # Filter out None values
-                valid = [(i, c) for i, c in enumerate(closes) if c is not None]
-                if len(valid) < 1:
-                    raise Exception("No valid price data available")
+@lru_cache(maxsize=8192)
+def _day_str(day: int) -> str:
+    """纪元日序号 -> "YYYY-MM-DD" (日线时间戳按天缓存格式化结果)"""
+    return date.fromordinal(_EPOCH_ORDINAL + day).isoformat()
 
-                last_idx = valid[-1][0]
-                prev_idx = valid[-2][0] if len(valid) > 1 else last_idx
 
-                price = closes[last_idx]
-                prev_price = closes[prev_idx]
-                change = price - prev_price
-                change_pct = (change / prev_price) * 100 if prev_price else 0
+def _chart_result(resp: httpx.Response) -> dict:
+    """解析 chart 接口响应，返回 result[0] (含 meta / timestamp / indicators)"""
+    chart = _json_loads(resp.content).get("chart") or {}
+    if chart.get("error"):
+        raise Exception(f"API Error: {chart['error'].get('description', 'Unknown API error')}")
+    result = (chart.get("result") or [None])[0]
+    if not result:
+        raise Exception("No data returned from API")
+    return result
+
+
+def _chart_bars(result: dict) -> list[tuple]:
+    """单次遍历 chart 各列，得到 (日期, 开, 高, 低, 收, 量) 日线
+
+    跳过收盘价为空的日线；开/高/低缺失时取收盘价，成交量缺失时为 0。
+    """
+    quote = ((result.get("indicators") or {}).get("quote") or [{}])[0]
+    closes = quote.get("close") or []
+    columns = zip(
+        result.get("timestamp") or [],
+        quote.get("open") or closes,
+        quote.get("high") or closes,
+        quote.get("low") or closes,
+        closes,
+        quote.get("volume") or repeat(0),
+    )
+    bars = []
+    append = bars.append
+    for ts, o, h, l, c, v in columns:
+        if c is None:
+            continue
+        append((
+            _day_str(ts // 86400),
+            c if o is None else o,
+            c if h is None else h,
+            c if l is None else l,
+            c,
+            v or 0,
+        ))
+    return bars
 
-                history = []
-                for i, ts in enumerate(timestamps):
-                    if closes[i] is None:
-                        continue
-                    dt = datetime.utcfromtimestamp(ts)
-                    history.append({
-                        "date": dt.strftime("%Y-%m-%d"),
-                        "open": round(opens[i] or 0, 2),
-                        "high": round(highs[i] or 0, 2),
-                        "low": round(lows[i] or 0, 2),
-                        "close": round(closes[i], 2),
-                        "volume": int(volumes[i] or 0),
-                    })
 
-                return {
-                    "symbol": symbol,
-                    "ticker": ticker,
-                    "available": True,
-                    "source": "yahoo_finance",
-                    "price": round(price, 2),
-                    "change": round(change, 2),
-                    "change_pct": round(change_pct, 2),
-                    "currency": meta.get("currency", "USD"),
-                    "high": round(highs[last_idx] or price, 2),
-                    "low": round(lows[last_idx] or price, 2),
-                    "open": round(opens[last_idx] or price, 2),
-                    "volume": int(volumes[last_idx] or 0),
-                    "date": datetime.utcfromtimestamp(timestamps[last_idx]).strftime("%Y-%m-%d"),
-                    "history": history,
-                }
+# ---------------------------------------------------------------------------
+#  Price Data Sources
+# ---------------------------------------------------------------------------
+
+def _fetch_yahoo_finance(symbol: str, ticker: str, range_: str = DEFAULT_HISTORY_RANGE) -> dict:
+    """从 Yahoo Finance 获取期货价格 (日线写入本地历史库，之后只增量请求新数据)"""
+    source = "yahoo_finance"
+    since = _history_since(range_)
+    last_date = _history_last_date(symbol, source, since)
+
+    url = f"{YAHOO_BASE_URL}/v8/finance/chart/{ticker}"
+    if last_date:
+        # 从最后一根日线开始增量获取 (同时更新当天尚未收盘的数据)
+        period1 = int(datetime.strptime(last_date, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp())
+        params = {"period1": period1, "period2": int(time.time()), "interval": "1d"}
+        logger.info(f"[Yahoo Finance] Fetching {symbol} ({ticker}) since {last_date}")
+    else:
+        params = {"range": range_, "interval": "1d"}
+        logger.info(f"[Yahoo Finance] Fetching {symbol} ({ticker}) range={range_}")
+    
+    max_retries = 3
+    for attempt in range(max_retries):
+        try:
+            resp = _yf_get(url, params)
+            if resp.status_code == 404:
+                raise InstrumentNotFound(f"Ticker {ticker} not found")
+            if resp.status_code == 200 and resp.content:
+                result_data = _chart_result(resp)
+                bars = _chart_bars(result_data)
+                if not bars and not last_date:
+                    raise Exception("Missing required data fields")
+                # 增量请求期间可能没有新的日线 (如周末)
+                _history_store(symbol, source, bars, None if last_date else since)
+
+                history = _history_load(symbol, source, since)
+                currency = (result_data.get("meta") or {}).get("currency", "USD")
+                return _price_from_bars(symbol, ticker, source, history, currency)
             elif attempt < max_retries - 1:
                 logger.warning(f"[Yahoo Finance] Attempt {attempt + 1} failed for {symbol}: Status {resp.status_code}, retrying...")
+                _m_retries.inc(upstream="yahoo_finance", reason="status")
                 time.sleep(1)
             else:
                 raise Exception(f"Failed after {max_retries} attempts. Status: {resp.status_code}")
                 
-        except requests.exceptions.Timeout:
+        except InstrumentNotFound:
+            raise
+        except httpx.TimeoutException:
             if attempt < max_retries - 1:
                 logger.warning(f"[Yahoo Finance] Attempt {attempt + 1} timed out for {symbol}, retrying...")
+                _m_retries.inc(upstream="yahoo_finance", reason="timeout")
                 time.sleep(1)
             else:
                 raise Exception(f"Request timeout after {max_retries} attempts")
         except Exception as e:
             if attempt < max_retries - 1:
                 logger.warning(f"[Yahoo Finance] Attempt {attempt + 1} failed with error for {symbol}: {str(e)}, retrying...")
+                _m_retries.inc(upstream="yahoo_finance", reason="error")
                 time.sleep(1)
             else:
                 raise Exception(f"Network error after {max_retries} attempts: {str(e)}")
@@ -242,192 +1822,260 @@ def _fetch_yahoo_finance(symbol: str, ticker: str) -> dict:
     raise Exception("All retry attempts exhausted")
 
 
-def _fetch_alpha_vantage(symbol: str, ticker: str) -> dict:
+def _fetch_alpha_vantage(symbol: str, ticker: str, range_: str = DEFAULT_HISTORY_RANGE) -> dict:
     """从 Alpha Vantage 获取价格 (需要API Key)"""
     if not ALPHA_VANTAGE_API_KEY:
         raise Exception("Alpha Vantage API key not configured")
+
+    source = "alpha_vantage"
+    since = _history_since(range_)
+    last_date = _history_last_date(symbol, source, since)
+    # compact 只返回最近100个交易日；本地已有数据且缺口在此范围内时无需 full
+    # 免费版请求 full 会返回 "Information" 提示，只能使用 compact
+    compact_since = (datetime.utcnow() - timedelta(days=140)).strftime("%Y-%m-%d")
+    outputsize = "full" if AV_PREMIUM and (last_date or since) < compact_since else "compact"
+
+    if not _av_budget.acquire(priority=_av_budget.is_viewed(symbol)):
+        raise SourceSkipped("Skipped (Alpha Vantage request budget exhausted)")
+
+    logger.info(f"[Alpha Vantage] Fetching {symbol} ({ticker}) outputsize={outputsize}")
     
-    logger.info(f"[Alpha Vantage] Fetching {symbol} ({ticker})")
-    
-    url = "https://www.alphavantage.co/query"
+    url = f"{AV_BASE_URL}/query"
     params = {
         "function": "TIME_SERIES_DAILY",
         "symbol": ticker,
         "apikey": ALPHA_VANTAGE_API_KEY,
-        "outputsize": "compact"  # 最近100个交易日
+        "outputsize": outputsize,
     }
     
-    resp = requests.get(url, params=params, timeout=15)
+    resp = _upstream.get("alpha_vantage", url, params=params, timeout=15)
     if resp.status_code != 200:
         raise Exception(f"HTTP {resp.status_code}")
     
     data = resp.json()
     
     if "Error Message" in data:
+        if "Invalid API call" in data["Error Message"]:
+            # 代码不存在
+            raise InstrumentNotFound(data["Error Message"])
         raise Exception(data["Error Message"])
     
     if "Note" in data:
+        # 每分钟额度耗尽
+        _av_budget.drain()
         raise Exception("API call frequency limit reached")
+
+    if "Information" in data:
+        info = data["Information"]
+        if "per day" in info.lower() or "daily" in info.lower():
+            # 每日额度耗尽，到 UTC 零点前不再调用
+            _av_budget.drain(day=True)
+        else:
+            # 需要付费的参数或其他提示，只清空本分钟额度
+            _av_budget.drain()
+        raise Exception(info)
     
     time_series = data.get("Time Series (Daily)")
     if not time_series:
         raise Exception("No time series data returned")
-    
-    # 获取最近的两个交易日
-    dates = sorted(time_series.keys(), reverse=True)[:2]
-    if len(dates) < 2:
+
+    # 只写入本地尚未有的 (以及最后一天可能更新的) 日线
+    bars = []
+    for date_str, day_data in time_series.items():
+        if last_date and date_str < last_date:
+            continue
+        bars.append((
+            date_str,
+            float(day_data["1. open"]),
+            float(day_data["2. high"]),
+            float(day_data["3. low"]),
+            float(day_data["4. close"]),
+            int(day_data["5. volume"]),
+        ))
+    # 只记录实际取得的覆盖范围：compact 达不到 since 时不能把整个范围标记为已回填
+    covered = since if outputsize == "full" else max(since, min(time_series))
+    _history_store(symbol, source, bars, None if last_date else covered)
+
+    history = _history_load(symbol, source, since)
+    if len(history) < 2:
         raise Exception("Insufficient historical data")
+    return _price_from_bars(symbol, ticker, source, history)
+
+
+def _fetch_generic_yahoo(symbol: str, ticker: str, source_name: str) -> dict:
+    """通用 Yahoo Finance 数据获取 (用于ETF和股票)"""
+    logger.info(f"[{source_name}] Fetching {symbol} ({ticker})")
     
-    latest_date = dates[0]
-    prev_date = dates[1]
-    
-    latest_data = time_series[latest_date]
-    prev_data = time_series[prev_date]
+    url = f"{YAHOO_BASE_URL}/v8/finance/chart/{ticker}"
+    params = {"range": "1mo", "interval": "1d"}
     
-    price = float(latest_data["4. close"])
-    prev_price = float(prev_data["4. close"])
+    resp = _yf_get(url, params)
+    if resp.status_code == 404:
+        raise InstrumentNotFound(f"Ticker {ticker} not found")
+    if resp.status_code != 200:
+        raise Exception(f"HTTP {resp.status_code}")
+
+    result_data = _chart_result(resp)
+    bars = _chart_bars(result_data)
+    if len(bars) < 2:
+        raise Exception("Insufficient data points")
+
+    last_day, open_, high, low, price, volume = bars[-1]
+    prev_price = bars[-2][4]
     change = price - prev_price
     change_pct = (change / prev_price) * 100
-    
-    # 构建历史数据 (最近30天)
-    history = []
-    for date_str in dates[:30]:
-        day_data = time_series[date_str]
-        history.append({
-            "date": date_str,
-            "open": round(float(day_data["1. open"]), 2),
-            "high": round(float(day_data["2. high"]), 2),
-            "low": round(float(day_data["3. low"]), 2),
-            "close": round(float(day_data["4. close"]), 2),
-            "volume": int(day_data["5. volume"]),
-        })
-    
+
+    # 简化的5天历史数据 (最新在前)
+    history = [{
+        "date": d,
+        "open": round(o, 2),
+        "high": round(h, 2),
+        "low": round(l, 2),
+        "close": round(c, 2),
+        "volume": int(v),
+    } for d, o, h, l, c, v in reversed(bars[-5:])]
+
     return {
         "symbol": symbol,
         "ticker": ticker,
         "available": True,
-        "source": "alpha_vantage",
+        "source": source_name.lower().replace(" ", "_"),
         "price": round(price, 2),
         "change": round(change, 2),
         "change_pct": round(change_pct, 2),
-        "currency": "USD",
-        "high": round(float(latest_data["2. high"]), 2),
-        "low": round(float(latest_data["3. low"]), 2),
-        "open": round(float(latest_data["1. open"]), 2),
-        "volume": int(latest_data["5. volume"]),
-        "date": latest_date,
+        "currency": (result_data.get("meta") or {}).get("currency", "USD"),
+        "high": round(high, 2),
+        "low": round(low, 2),
+        "open": round(open_, 2),
+        "volume": int(volume),
+        "date": last_day,
         "history": history,
     }
 
 
-def _fetch_generic_yahoo(symbol: str, ticker: str, source_name: str) -> dict:
-    """通用 Yahoo Finance 数据获取 (用于ETF和股票)"""
-    logger.info(f"[{source_name}] Fetching {symbol} ({ticker})")
-    
-    url = f"https://query1.finance.yahoo.com/v8/finance/chart/{ticker}"
-    params = {"range": "1mo", "interval": "1d"}
-    
-    resp = _yf_session.get(url, params=params, timeout=15)
-    if resp.status_code != 200:
-        raise Exception(f"HTTP {resp.status_code}")
-    
-    data = resp.json()
-    chart = data.get("chart", {})
-    if chart.get("error"):
-        raise Exception(chart["error"].get("description", "API error"))
-    
-    result_data = chart.get("result", [{}])[0]
-    if not result_data:
-        raise Exception("No data returned")
-    
-    meta = result_data.get("meta", {})
-    timestamps = result_data.get("timestamp", [])
-    indicators = result_data.get("indicators", {})
-    quotes = indicators.get("quote", [{}])[0]
-    
-    if not timestamps or not quotes.get("close"):
-        raise Exception("Missing data fields")
-    
-    closes = quotes["close"]
-    valid = [(i, c) for i, c in enumerate(closes) if c is not None]
-    if len(valid) < 2:
-        raise Exception("Insufficient data points")
-    
-    last_idx = valid[-1][0]
-    prev_idx = valid[-2][0]
-    
-    price = closes[last_idx]
-    prev_price = closes[prev_idx]
+def _quote_from_chart(symbol: str, ticker: str, chart: dict, source: str) -> dict:
+    """从 chart 结构中提取最新报价 (不含历史数据)
+
+    v7 spark 只返回收盘价序列：最高/最低/成交量取自 meta 的 regularMarketDay*，
+    开盘价只在序列含 open 列时给出，无法得到的字段不返回。
+    """
+    meta = chart.get("meta") or {}
+    bars = _chart_bars(chart)
+    if not bars:
+        raise Exception("No valid price data available")
+
+    last_day, open_, _, _, price, _ = bars[-1]
+    if len(bars) > 1:
+        prev_price = bars[-2][4]
+    else:
+        prev_price = meta.get("chartPreviousClose") or price
     change = price - prev_price
-    change_pct = (change / prev_price) * 100
-    
-    # 简化的5天历史数据
-    history = []
-    for i in range(min(5, len(valid))):
-        idx = valid[-(i+1)][0]
-        ts = timestamps[idx]
-        dt = datetime.utcfromtimestamp(ts)
-        history.append({
-            "date": dt.strftime("%Y-%m-%d"),
-            "open": round(quotes.get("open", [0]*len(closes))[idx] or price, 2),
-            "high": round(quotes.get("high", [0]*len(closes))[idx] or price, 2),
-            "low": round(quotes.get("low", [0]*len(closes))[idx] or price, 2),
-            "close": round(closes[idx], 2),
-            "volume": int(quotes.get("volume", [0]*len(closes))[idx] or 0),
-        })
-    
-    return {
+    change_pct = (change / prev_price) * 100 if prev_price else 0
+
+    quote = {
         "symbol": symbol,
         "ticker": ticker,
         "available": True,
-        "source": source_name.lower().replace(" ", "_"),
+        "source": source,
         "price": round(price, 2),
         "change": round(change, 2),
         "change_pct": round(change_pct, 2),
         "currency": meta.get("currency", "USD"),
-        "high": round(quotes.get("high", [0]*len(closes))[last_idx] or price, 2),
-        "low": round(quotes.get("low", [0]*len(closes))[last_idx] or price, 2),
-        "open": round(quotes.get("open", [0]*len(closes))[last_idx] or price, 2),
-        "volume": int(quotes.get("volume", [0]*len(closes))[last_idx] or 0),
-        "date": datetime.utcfromtimestamp(timestamps[last_idx]).strftime("%Y-%m-%d"),
-        "history": history,
+        "date": last_day,
     }
+    if meta.get("regularMarketDayHigh"):
+        quote["high"] = round(meta["regularMarketDayHigh"], 2)
+    if meta.get("regularMarketDayLow"):
+        quote["low"] = round(meta["regularMarketDayLow"], 2)
+    if ((chart.get("indicators") or {}).get("quote") or [{}])[0].get("open"):
+        quote["open"] = round(open_, 2)
+    if meta.get("regularMarketVolume") is not None:
+        quote["volume"] = int(meta["regularMarketVolume"])
+    return quote
+
+
+def _fetch_yahoo_quotes(ticker_map: dict[str, str], source_name: str) -> dict[str, dict]:
+    """批量获取多个 Yahoo 代码的最新报价 (不含历史数据，每次请求最多 YAHOO_SPARK_MAX_SYMBOLS 个代码)"""
+    tickers = sorted(set(ticker_map.values()))
+    logger.info(f"[{source_name}] Bulk quote for {len(tickers)} tickers")
+
+    charts = {}
+    for i in range(0, len(tickers), YAHOO_SPARK_MAX_SYMBOLS):
+        params = {"symbols": ",".join(tickers[i:i + YAHOO_SPARK_MAX_SYMBOLS]), "range": "5d", "interval": "1d"}
+        resp = _yf_get(YAHOO_QUOTE_URL, params)
+        if resp.status_code != 200:
+            raise Exception(f"HTTP {resp.status_code}")
+
+        spark = _json_loads(resp.content).get("spark") or {}
+        if spark.get("error"):
+            raise Exception(spark["error"].get("description", "API error"))
+
+        for item in spark.get("result") or []:
+            if item.get("response"):
+                charts[item.get("symbol")] = item["response"][0]
+
+    source = source_name.lower().replace(" ", "_")
+    quotes = {}
+    for symbol, ticker in ticker_map.items():
+        chart = charts.get(ticker)
+        if not chart:
+            continue
+        try:
+            quotes[symbol] = _quote_from_chart(symbol, ticker, chart, source)
+        except Exception as e:
+            logger.warning(f"[{source_name}] Bad quote for {symbol} ({ticker}): {e}")
+    return quotes
+
+
+def _unsupported(symbol: str) -> dict:
+    return _format_error(
+        symbol,
+        "unsupported",
+        f"No data source configured for {symbol}.\n\nAvailable metals: {', '.join(INSTRUMENTS)}",
+    )
+
+
+def _negative_cached(symbol: str, source: str) -> str | None:
+    """该数据源确认代码不存在时写入的原因；未命中或已过期返回 None"""
+    entry = _cache.get(f"neg:{symbol}:{source}")
+    if entry is None or _cache_expired(f"neg:{symbol}:{source}", entry[0]):
+        return None
+    return entry[1]
 
 
-def get_price_multi_source(symbol: str) -> dict:
-    """多数据源价格获取 - 自动尝试不同数据源直到成功"""
+def _instrument_sources(symbol: str) -> list[tuple[str, str]]:
+    """(数据源, 代码) 按该元素配置的优先级排列，不健康的数据源排在其后"""
+    sources = INSTRUMENTS[symbol]["sources"]
+    return [(source, sources[source]) for source in _ordered_sources(list(sources))]
+
+
+def get_price_multi_source(symbol: str, range_: str = DEFAULT_HISTORY_RANGE) -> dict:
+    """多数据源价格获取 - 按注册表中该元素的数据源依次尝试直到成功"""
+    if symbol not in INSTRUMENTS:
+        return _unsupported(symbol)
     errors = []
     
-    for source in PRICE_SOURCES:
+    for source, ticker in _instrument_sources(symbol):
+        if source == "yahoo_finance":
+            fetch = lambda: _fetch_yahoo_finance(symbol, ticker, range_)
+        elif source == "alpha_vantage":
+            if not ALPHA_VANTAGE_API_KEY:
+                errors.append((source, "Alpha Vantage API key not configured"))
+                continue
+            fetch = lambda: _fetch_alpha_vantage(symbol, ticker, range_)
+        else:
+            fetch = lambda: _fetch_generic_yahoo(symbol, ticker, PRICE_SOURCE_NAMES[source])
+
+        reason = _negative_cached(symbol, source)
+        if reason:
+            errors.append((source, f"{reason} (cached)"))
+            continue
         try:
-            if source == "yahoo_finance":
-                ticker = YAHOO_TICKERS.get(symbol)
-                if not ticker:
-                    errors.append((source, "No ticker symbol configured"))
-                    continue
-                return _fetch_yahoo_finance(symbol, ticker)
-                
-            elif source == "alpha_vantage":
-                ticker = ETF_TICKERS.get(symbol, YAHOO_TICKERS.get(symbol))
-                if not ticker:
-                    errors.append((source, "No ticker symbol configured"))
-                    continue
-                return _fetch_alpha_vantage(symbol, ticker)
-                
-            elif source == "metal_etf":
-                ticker = ETF_TICKERS.get(symbol)
-                if not ticker:
-                    errors.append((source, "No ETF ticker symbol configured"))
-                    continue
-                return _fetch_generic_yahoo(symbol, ticker, "Metal ETF")
-                
-            elif source == "mining_stock":
-                ticker = STOCK_TICKERS.get(symbol)
-                if not ticker:
-                    errors.append((source, "No stock ticker symbol configured"))
-                    continue
-                return _fetch_generic_yahoo(symbol, ticker, "Mining Stock")
-                
+            return _call_source(source, fetch)
+        except InstrumentNotFound as e:
+            logger.warning(f"Source {source} has no data for {symbol} ({ticker}): {e}")
+            _cache_set(f"neg:{symbol}:{source}", str(e))
+            errors.append((source, str(e)))
         except Exception as e:
             error_msg = str(e)
             logger.warning(f"Source {source} failed for {symbol}: {error_msg}")
@@ -436,60 +2084,850 @@ def get_price_multi_source(symbol: str) -> dict:
     
     # 所有数据源都失败
     error_details = "\n".join([f"- {src}: {msg}" for src, msg in errors])
-    return _format_error(
-        symbol, 
-        "all_sources", 
-        f"All data sources failed:\n{error_details}\n\nAvailable metals: {', '.join(YAHOO_TICKERS.keys())}"
-    )
+    return _format_error(symbol, "all_sources", f"All data sources failed:\n{error_details}")
+
+
+def _quote_group(source: str, group: list[str]) -> tuple[dict[str, dict], dict[str, str]]:
+    """从单个数据源获取一组符号的报价，返回 (报价, 失败原因)"""
+    quotes, errors = {}, {}
+    for sym in group:
+        reason = _negative_cached(sym, source)
+        if reason:
+            errors[sym] = f"{reason} (cached)"
+    group = [sym for sym in group if sym not in errors]
+
+    if source == "alpha_vantage":
+        # Alpha Vantage 没有批量接口，只能逐个请求
+        if not ALPHA_VANTAGE_API_KEY:
+            return quotes, {**errors, **{sym: "Alpha Vantage API key not configured" for sym in group}}
+
+        def fetch_av(sym):
+            ticker = INSTRUMENTS[sym]["sources"][source]
+            try:
+                quote = _call_source(source, lambda: _fetch_alpha_vantage(sym, ticker))
+            except InstrumentNotFound as e:
+                _cache_set(f"neg:{sym}:{source}", str(e))
+                raise
+            quote.pop("history", None)
+            return quote
+
+        futures = {sym: _price_executor.submit(fetch_av, sym) for sym in group}
+        for sym, fut in futures.items():
+            try:
+                quotes[sym] = fut.result()
+            except Exception as e:
+                errors[sym] = str(e)
+        return quotes, errors
+
+    # 经 _cache_fetch 加载：并发的冷请求共用一次 spark 请求
+    try:
+        cached = _cache_fetch(
+            f"quotes:{source}",
+            lambda: _call_source(source, lambda: _fetch_yahoo_quotes(_source_tickers(source), PRICE_SOURCE_NAMES[source])),
+        )
+    except Exception as e:
+        logger.warning(f"Bulk source {source} failed: {e}")
+        return quotes, {**errors, **{sym: str(e) for sym in group}}
+    for sym in group:
+        if sym in cached:
+            quotes[sym] = cached[sym]
+        else:
+            errors[sym] = "No quote returned"
+    return quotes, errors
+
+
+def get_quotes_multi_source(symbols: list[str]) -> tuple[dict[str, dict], dict[str, float]]:
+    """批量获取最新报价 - 每个数据源只发一次请求，按各元素配置的优先级依次补齐失败的符号
+
+    返回 (报价, 每个符号完成时的耗时毫秒数)。未注册的符号立即返回 unsupported。
+    """
+    start = time.perf_counter()
+    results: dict[str, dict] = {}
+    timing: dict[str, float] = {}
+    errors: dict[str, list] = {sym: [] for sym in symbols}
+    for sym in symbols:
+        if sym not in INSTRUMENTS:
+            results[sym], timing[sym] = _unsupported(sym), 0.0
+    plans = {sym: _instrument_sources(sym) for sym in symbols if sym not in results}
+    pending = list(plans)
+
+    while pending:
+        # 每一轮按各符号的下一个数据源分组，同一数据源只请求一次
+        groups: dict[str, list[str]] = {}
+        for sym in pending:
+            if plans[sym]:
+                source, _ = plans[sym].pop(0)
+                groups.setdefault(source, []).append(sym)
+        if not groups:
+            break
+        for source, group in groups.items():
+            quotes, failed = _quote_group(source, group)
+            for sym, quote in quotes.items():
+                results[sym] = quote
+                timing[sym] = (time.perf_counter() - start) * 1000
+            for sym, msg in failed.items():
+                errors[sym].append((source, msg))
+        pending = [sym for sym in pending if sym not in results]
+
+    for sym in pending:
+        error_details = "\n".join([f"- {src}: {msg}" for src, msg in errors[sym]])
+        results[sym] = _format_error(sym, "all_sources", f"All data sources failed:\n{error_details}")
+        timing[sym] = (time.perf_counter() - start) * 1000
+    return results, timing
+
+
+def _load_price(symbol: str, range_: str = DEFAULT_HISTORY_RANGE) -> dict:
+    # 使用多数据源方法获取价格
+    result = get_price_multi_source(symbol, range_)
+    if result.get("available", False):
+        logger.info(f"Successfully fetched price for {symbol} from {result.get('source', 'unknown')} source: ${result['price']}")
+    else:
+        logger.warning(f"Failed to fetch price for {symbol}: {result.get('message', 'Unknown error')}")
+    return result
+
+
+def _get_price_cached(symbol: str, range_: str = DEFAULT_HISTORY_RANGE) -> dict:
+    """读取缓存或通过多数据源获取价格 (单个与批量接口共用)"""
+    cache_key = f"price:{symbol}" if range_ == DEFAULT_HISTORY_RANGE else f"price:{symbol}:{range_}"
+    try:
+        # 获取失败的结果不缓存，允许下次重新尝试
+        return _cache_fetch(
+            cache_key,
+            lambda: _load_price(symbol, range_),
+            accept=lambda r: r.get("available", False),
+        )
+    except Exception as e:
+        logger.exception(f"Unexpected error in get_price for {symbol}")
+        return _format_error(symbol, "exception", str(e))
+
+
 @app.route("/api/price/<symbol>")
 def get_price(symbol: str):
-    """Return latest price data for a metal element symbol (e.g. Cu, Au)."""
+    """Return latest price data for a metal element symbol (e.g. Cu, Au).
+
+    Query: ``range`` selects the chart history length (1mo, 3mo, 6mo, 1y, 2y, 5y);
+    ``format=columnar`` returns ``history`` as parallel arrays keyed by epoch-day offsets.
+    """
+    range_ = request.args.get("range", DEFAULT_HISTORY_RANGE)
+    if range_ not in HISTORY_RANGES:
+        range_ = DEFAULT_HISTORY_RANGE
     symbol = symbol.strip()
-    cache_key = f"price:{symbol}"
-    cached = _cache_get(cache_key)
-    if cached is not None:
-        # 如果缓存中的数据是成功的，直接返回
+    # 单个价格接口对应用户正在查看的面板，Alpha Vantage 额度优先分配给它
+    if symbol in INSTRUMENTS:
+        _av_budget.mark_viewed(symbol)
+    data = _get_price_cached(symbol, range_)
+    if request.args.get("format") == "columnar" and data.get("history"):
+        data = {**data, "history": _history_columnar(data["history"]), "format": "columnar"}
+    return jsonify(data)
+
+
+@app.route("/api/prices")
+def get_prices():
+    """Return latest quotes for several symbols in one payload.
+
+    Query: ``symbols=Au,Ag,Cu`` (defaults to every configured metal).
+    History is not included; the chart loads it via ``/api/price/<symbol>``.
+    """
+    raw = request.args.get("symbols", "")
+    symbols = [s.strip() for s in raw.split(",") if s.strip()] or list(INSTRUMENTS)
+    symbols = list(dict.fromkeys(symbols))[:MAX_BATCH_SYMBOLS]
+
+    start = time.perf_counter()
+    prices, timing = {}, {}
+    for sym in symbols:
+        cached = _cache_get(f"price:{sym}")
         if isinstance(cached, dict) and cached.get("available", False):
-            return jsonify(cached)
-        # 如果缓存中的数据是失败的，允许重新尝试
-        
-    # 使用多数据源方法获取价格
-    try:
-        result = get_price_multi_source(symbol)
-        if result.get("available", False):
-            _cache_set(cache_key, result)
-            logger.info(f"Successfully fetched price for {symbol} from {result.get('source', 'unknown')} source: ${result['price']}")
+            prices[sym] = {k: v for k, v in cached.items() if k != "history"}
+            timing[sym] = 0.0
+
+    missing = [sym for sym in symbols if sym not in prices]
+    if missing:
+        try:
+            quotes, quote_timing = get_quotes_multi_source(missing)
+            prices.update(quotes)
+            timing.update(quote_timing)
+        except Exception as e:
+            logger.exception("Batch quote fetch failed")
+            for sym in missing:
+                prices[sym], timing[sym] = _format_error(sym, "exception", str(e)), 0.0
+
+    return jsonify({
+        "prices": prices,
+        "timing_ms": {sym: round(ms, 1) for sym, ms in timing.items()},
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+    })
+
+
+# ---------------------------------------------------------------------------
+#  Cross-metal Matrix
+# ---------------------------------------------------------------------------
+MATRIX_DEFAULT_WINDOW = 60      # 交易日
+MATRIX_MAX_WINDOW = 1000
+MATRIX_PAIRS = (("Au", "Ag"), ("Pt", "Pd"), ("Cu", "Al"))
+MATRIX_MAX_STATES = 8           # 同时维护的窗口数
+MATRIX_REBUILD_EVERY = 5000     # 增量更新次数达到该值后从历史库重建，消除累计和的浮点误差
+
+
+class MetalMatrix:
+    """滚动窗口内各金属对数价格与对数收益率的累计和 (一阶与外积)
+
+    相关系数、比值均值/Z 分数都可由这些累计和直接得出：追加一根日线只需加上新项、
+    减去移出窗口的项，盘中报价更新最后一根日线时先减后加，无需重算整个窗口。
+    """
+
+    def __init__(self, symbols: list[str], window: int):
+        self.symbols = symbols
+        self.window = window
+        n = len(symbols)
+        self._entries: deque = deque()     # (date, log_close, log_return)
+        self._sum_l, self._sum_ll = np.zeros(n), np.zeros((n, n))
+        self._sum_r, self._sum_rr = np.zeros(n), np.zeros((n, n))
+        self.lock = threading.Lock()
+        self.stats = {"appends": 0, "updates": 0}
+
+    @property
+    def last_date(self) -> str | None:
+        return self._entries[-1][0] if self._entries else None
+
+    def _add(self, l: np.ndarray, r: np.ndarray, sign: float):
+        self._sum_l += sign * l
+        self._sum_ll += sign * np.outer(l, l)
+        self._sum_r += sign * r
+        self._sum_rr += sign * np.outer(r, r)
+
+    def seed(self, date: str, log_close: np.ndarray):
+        """窗口起点前一日的价格，只用于计算第一条收益率"""
+        self._entries.append((date, log_close, None))
+
+    def append(self, date: str, log_close: np.ndarray):
+        log_close = np.where(np.isnan(log_close), self._entries[-1][1], log_close)
+        r = log_close - self._entries[-1][1]
+        self._entries.append((date, log_close, r))
+        self._add(log_close, r, 1)
+        if self._entries[0][2] is None:
+            self._entries.popleft()
+        while len(self._entries) > self.window:
+            _, l_old, r_old = self._entries.popleft()
+            self._add(l_old, r_old, -1)
+        self.stats["appends"] += 1
+
+    def update_last(self, log_close: np.ndarray):
+        date, l_old, r_old = self._entries[-1]
+        log_close = np.where(np.isnan(log_close), l_old, log_close)
+        if np.array_equal(log_close, l_old):
+            return
+        r = r_old + (log_close - l_old)
+        self._add(l_old, r_old, -1)
+        self._add(log_close, r, 1)
+        self._entries[-1] = (date, log_close, r)
+        self.stats["updates"] += 1
+
+    def apply(self, date: str, closes: dict[str, float]):
+        """按日期追加新日线或更新当日价格；早于最后一根日线的数据忽略"""
+        log_close = np.array([math.log(closes[s]) if closes.get(s) else np.nan for s in self.symbols])
+        if self.last_date is None or date < self.last_date:
+            return
+        if date == self.last_date:
+            self.update_last(log_close)
         else:
-            logger.warning(f"Failed to fetch price for {symbol}: {result.get('message', 'Unknown error')}")
-        return jsonify(result)
-    except Exception as e:
-        logger.exception(f"Unexpected error in get_price for {symbol}")
-        return jsonify(_format_error(symbol, "exception", str(e)))
+            self.append(date, log_close)
+
+    def snapshot(self) -> dict:
+        n = len(self._entries)
+        last = self._entries[-1][1]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cov_r = self._sum_rr / n - np.outer(self._sum_r, self._sum_r) / n ** 2
+            sd_r = np.sqrt(np.diag(cov_r))
+            corr = cov_r / np.outer(sd_r, sd_r)
+
+            mean_l = self._sum_l / n
+            cov_l = self._sum_ll / n - np.outer(mean_l, mean_l)
+            var_l = np.diag(cov_l)
+            # log(P_i / P_j) 的窗口均值与标准差
+            log_ratio = last[:, None] - last[None, :]
+            mean_ratio = mean_l[:, None] - mean_l[None, :]
+            sd_ratio = np.sqrt(np.maximum(var_l[:, None] + var_l[None, :] - 2 * cov_l, 0))
+            zscore = (log_ratio - mean_ratio) / sd_ratio
+            price = np.exp(last)
+
+        def matrix(m: np.ndarray, digits: int = 4) -> list[list]:
+            return [[_num(v, digits) for v in row] for row in m]
+
+        ratio = np.exp(log_ratio)
+        spread = price[:, None] - price[None, :]
+        idx = {s: i for i, s in enumerate(self.symbols)}
+        pairs = {
+            f"{a}/{b}": {
+                "ratio": _num(ratio[idx[a], idx[b]]),
+                "ratio_mean": _num(math.exp(mean_ratio[idx[a], idx[b]])),
+                "ratio_zscore": _num(zscore[idx[a], idx[b]], 2),
+                "spread": _num(spread[idx[a], idx[b]], 2),
+                "correlation": _num(corr[idx[a], idx[b]]),
+            }
+            for a, b in MATRIX_PAIRS if a in idx and b in idx
+        }
+        return {
+            "symbols": self.symbols,
+            "window": self.window,
+            "observations": n,
+            "from": self._entries[0][0],
+            "as_of": self._entries[-1][0],
+            "correlation": matrix(corr),
+            "ratio": matrix(ratio),
+            "ratio_zscore": matrix(zscore, 2),
+            "spread": matrix(spread, 2),
+            "pairs": pairs,
+            **self.stats,
+        }
+
+
+_matrices: dict[int, MetalMatrix] = {}
+_matrices_lock = threading.Lock()
+
+
+def _build_matrix(window: int) -> MetalMatrix | None:
+    """从本地历史库构建窗口 (多取一些自然日以覆盖周末和假日)"""
+    since = (datetime.utcnow() - timedelta(days=window * 7 // 5 + 14)).strftime("%Y-%m-%d")
+    symbols, dates, fields = _history_panel(since)
+    if not dates:
+        return None
+    close = _ffill(fields["close"])
+    complete = np.flatnonzero(~np.isnan(close).any(axis=0))
+    if complete.size < 3:
+        return None
+    log_close = np.log(close[:, complete[-(window + 1):]])
+    kept_dates = [dates[i] for i in complete[-(window + 1):]]
+
+    m = MetalMatrix(symbols, window)
+    m.seed(kept_dates[0], log_close[:, 0])
+    for j in range(1, len(kept_dates)):
+        m.append(kept_dates[j], log_close[:, j])
+    m.stats["appends"] = 0
+    return m
+
+
+def _sync_matrix(m: MetalMatrix):
+    """把本地历史库中新增的日线和最新推送报价增量应用到矩阵"""
+    symbols, dates, fields = _history_panel(m.last_date)
+    for j, date in enumerate(dates):
+        m.apply(date, {s: fields["close"][i, j] for i, s in enumerate(symbols) if not np.isnan(fields["close"][i, j])})
+    with _stream_lock:
+        quotes = dict(_stream_last)
+    _matrix_apply_quotes(m, quotes)
+
+
+def _matrix_apply_quotes(m: MetalMatrix, quotes: dict[str, dict]):
+    """矩阵只含期货价格，降级得到的 ETF / 股票报价不参与更新"""
+    by_date: dict[str, dict[str, float]] = {}
+    for sym, q in quotes.items():
+        if (sym in m.symbols and q.get("source") == "yahoo_finance"
+                and q.get("price") and q.get("date")):
+            by_date.setdefault(q["date"], {})[sym] = q["price"]
+    for date in sorted(by_date):
+        m.apply(date, by_date[date])
+
+
+def _matrix_on_tick(quotes: dict[str, dict]):
+    """价格轮询线程的回调：已构建的矩阵随每次报价变化增量更新"""
+    with _matrices_lock:
+        matrices = list(_matrices.values())
+    for m in matrices:
+        with m.lock:
+            _matrix_apply_quotes(m, quotes)
+
+
+@app.route("/api/matrix")
+def get_matrix():
+    """Correlation, ratio and spread matrices across all metals.
+
+    Query: ``window`` in trading days (default 60). Matrices are ordered as ``symbols``.
+    """
+    try:
+        window = min(MATRIX_MAX_WINDOW, max(5, int(request.args.get("window", MATRIX_DEFAULT_WINDOW))))
+    except ValueError:
+        return jsonify({"error": "window must be an integer."}), 400
+
+    with _matrices_lock:
+        m = _matrices.get(window)
+    if m is None or m.stats["appends"] + m.stats["updates"] >= MATRIX_REBUILD_EVERY:
+        m = _build_matrix(window)
+        if m is None:
+            return jsonify({"error": "Not enough local price history", "window": window}), 404
+        with _matrices_lock:
+            _matrices.pop(window, None)
+            while len(_matrices) >= MATRIX_MAX_STATES:
+                _matrices.pop(next(iter(_matrices)))
+            _matrices[window] = m
+
+    start = time.perf_counter()
+    with m.lock:
+        _sync_matrix(m)
+        result = m.snapshot()
+    result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return jsonify(result)
+
+
+@app.route("/api/indicators/<symbol>")
+def get_indicators(symbol: str):
+    """Technical indicators computed from the local OHLC history store.
+
+    Query: ``range`` (default 1y) and ``series=1`` to include full time series.
+    """
+    range_ = request.args.get("range", DEFAULT_INDICATOR_RANGE)
+    if range_ not in HISTORY_RANGES:
+        range_ = DEFAULT_INDICATOR_RANGE
+    symbol = symbol.strip()
+
+    summary = _get_indicators(range_)
+    if symbol not in summary["metals"] and symbol in YAHOO_TICKERS:
+        # 本地还没有该范围的日线：先回填一次；只有确实写入了期货日线时才重新计算
+        # (价格来自降级数据源时指标仍不可用，不能让每个请求都清掉共享的指标缓存)
+        _get_price_cached(symbol, range_)
+        if _history_db().execute(
+            "SELECT 1 FROM bars WHERE symbol = ? AND source = 'yahoo_finance' AND date >= ? LIMIT 1",
+            (symbol, _history_since(range_)),
+        ).fetchone():
+            _cache.delete(f"indicators:{range_}")
+            summary = _get_indicators(range_)
+    metal = summary["metals"].get(symbol)
+    if metal is None:
+        return jsonify({"symbol": symbol, "available": False, "message": "No local price history"}), 404
+
+    result = {"symbol": symbol, "available": True, "range": range_, **metal}
+    if request.args.get("series") == "1":
+        result["series"] = _indicator_series(symbol, range_)
+    return jsonify(result)
+
+
+@app.route("/api/instruments")
+def get_instruments():
+    """Registered instruments with their data sources in priority order.
+
+    ``unavailable`` is set for sources that recently reported the ticker as unknown.
+    """
+    return jsonify({
+        sym: {
+            "name": spec["name"],
+            "sources": [
+                {"source": source, "ticker": ticker, "unavailable": _negative_cached(sym, source)}
+                for source, ticker in spec["sources"].items()
+            ],
+        }
+        for sym, spec in INSTRUMENTS.items()
+    })
+
+
+@app.route("/api/sources/health")
+def sources_health():
+    """Circuit-breaker state and rolling health score of each price source.
+
+    Also reports upstream concurrency and LLM client connection reuse.
+    """
+    return jsonify({
+        "order": _ordered_sources(),
+        "sources": [_source_health[s].snapshot() for s in PRICE_SOURCES],
+        "alpha_vantage_budget": _av_budget.snapshot(),
+        "upstreams": _upstream.stats(),
+        "llm_client": _llm_clients.stats(),
+        "llm_queue": _llm_gate.stats(),
+    })
 
 
 # ---------------------------------------------------------------------------
-#  Routes – News / Information
+#  Routes – Price Stream (SSE)
 # ---------------------------------------------------------------------------
-@app.route("/api/news/<symbol>")
-def get_news(symbol: str):
-    """Fetch categorised news for a metal element."""
-    category = request.args.get("category", "news")
-    lang = request.args.get("lang", "en")
-    metal_name = request.args.get("name", symbol)
+PRICE_STREAM_INTERVAL = 30    # 服务端轮询间隔 (秒)
+PRICE_STREAM_KEEPALIVE = 15   # 无变化时发送心跳的间隔 (秒)
+
+# 每个 SSE 连接一个队列；轮询线程只在价格变化时向队列推送增量
+_stream_subscribers: list[queue.Queue] = []
+_stream_lock = threading.Lock()
+_stream_last: dict[str, dict] = {}
+
+
+def _price_poller():
+    """单个后台轮询线程：批量获取报价，仅把发生变化的符号推送给订阅者"""
+    while True:
+        time.sleep(PRICE_STREAM_INTERVAL)
+        with _stream_lock:
+            if not _stream_subscribers:
+                continue
+        try:
+            quotes, _ = get_quotes_multi_source(list(INSTRUMENTS))
+        except Exception as e:
+            logger.warning(f"Price poller failed: {e}")
+            continue
 
-    cache_key = f"news:{symbol}:{category}:{lang}"
-    cached = _cache_get(cache_key)
-    if cached is not None:
-        return jsonify(cached)
+        deltas = {}
+        for sym, quote in quotes.items():
+            if not quote.get("available", False):
+                continue
+            last = _stream_last.get(sym)
+            if last is None or (last["price"], last["date"]) != (quote["price"], quote["date"]):
+                deltas[sym] = quote
+        if not deltas:
+            continue
+
+        with _stream_lock:
+            _stream_last.update(deltas)
+            for q in _stream_subscribers:
+                try:
+                    q.put_nowait(deltas)
+                except queue.Full:
+                    pass  # 客户端消费过慢，丢弃本次增量
+        try:
+            _matrix_on_tick(deltas)
+        except Exception as e:
+            logger.warning(f"Matrix tick update failed: {e}")
+
+
+@app.route("/api/stream/prices")
+def stream_prices():
+    """Server-sent price updates; only symbols whose price changed are pushed.
+
+    Query: ``symbols=Au,Cu`` limits the stream to those symbols.
+    """
+    raw = request.args.get("symbols", "")
+    wanted = {s.strip() for s in raw.split(",") if s.strip()}
+
+    def pick(prices: dict) -> dict:
+        return {sym: q for sym, q in prices.items() if not wanted or sym in wanted}
+
+    q = queue.Queue(maxsize=100)
+    with _stream_lock:
+        _stream_subscribers.append(q)
+        snapshot = pick(_stream_last)
+
+    def generate():
+        try:
+            if snapshot:
+                yield f"data: {json.dumps({'prices': snapshot})}\n\n"
+            while True:
+                try:
+                    deltas = pick(q.get(timeout=PRICE_STREAM_KEEPALIVE))
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if deltas:
+                    yield f"data: {json.dumps({'prices': deltas})}\n\n"
+        finally:
+            with _stream_lock:
+                _stream_subscribers.remove(q)
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream")
 
+
+# ---------------------------------------------------------------------------
+#  News Index
+# ---------------------------------------------------------------------------
+_news_schema_pid = None
+
+
+def _news_db() -> sqlite3.Connection:
+    global _news_schema_pid
+    conn = _sqlite_conn(NEWS_DB_PATH)
+    if _news_schema_pid != os.getpid():
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS articles ("
+            " id TEXT PRIMARY KEY, url_key TEXT, title_key TEXT,"
+            " title TEXT, url TEXT, body TEXT, date TEXT, source TEXT, image TEXT,"
+            " first_seen REAL, last_seen REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS articles_url_key ON articles (url_key)")
+        conn.execute("CREATE INDEX IF NOT EXISTS articles_title_key ON articles (title_key)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS article_tags ("
+            " id TEXT, symbol TEXT, category TEXT, lang TEXT, seen REAL,"
+            " PRIMARY KEY (id, symbol, category, lang))"
+        )
+        # 每个 (symbol, category, lang) 组合最近一次成功采集的时间
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS news_runs ("
+            " symbol TEXT, category TEXT, lang TEXT, ran_at REAL,"
+            " PRIMARY KEY (symbol, category, lang))"
+        )
+        # 用户最近一次查看每个组合的时间，后台只采集有人查看的组合
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS news_demand ("
+            " symbol TEXT, category TEXT, lang TEXT, requested_at REAL,"
+            " PRIMARY KEY (symbol, category, lang))"
+        )
+        # 全文索引 (title/body/source)，与 articles 按 id 对应
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5("
+            " id UNINDEXED, title, body, source, tokenize='unicode61 remove_diacritics 2')"
+        )
+        conn.execute(
+            "INSERT INTO articles_fts (id, title, body, source)"
+            " SELECT id, title, body, source FROM articles WHERE id NOT IN (SELECT id FROM articles_fts)"
+        )
+        _news_schema_pid = os.getpid()
+    return conn
+
+
+def _news_url_key(url: str) -> str:
+    """归一化 URL：忽略协议、www、结尾斜杠、锚点和跟踪参数"""
+    if not url:
+        return ""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower().removeprefix("www.")
+    params = sorted(
+        p for p in parts.query.split("&")
+        if p and not p.lower().startswith(("utm_", "fbclid=", "gclid="))
+    )
+    key = f"{host}{parts.path.rstrip('/')}"
+    return f"{key}?{'&'.join(params)}" if params else key
+
+
+def _news_title_key(title: str) -> str:
+    return re.sub(r"\W+", " ", title.lower()).strip()
+
+
+def _news_query(metal_name: str, category: str, lang: str) -> str:
     template = METAL_SEARCH_TEMPLATES.get(category, METAL_SEARCH_TEMPLATES["news"])
     query = template.format(metal=metal_name)
     if lang == "zh":
         query = query + " 中文"
+    return query
+
+
+def _news_index_store(symbol: str, category: str, lang: str, articles: list[dict]):
+    """写入文章并按 URL / 标题指纹去重，同一篇文章在不同分类下只保存一次"""
+    now = time.time()
+    conn = _news_db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for a in articles:
+            url_key = _news_url_key(a.get("url", ""))
+            title_key = _news_title_key(a.get("title", ""))
+            if not url_key and not title_key:
+                continue
+            row = conn.execute(
+                "SELECT id FROM articles WHERE (url_key = ? AND url_key != '') OR (title_key = ? AND title_key != '')"
+                " LIMIT 1",
+                (url_key, title_key),
+            ).fetchone()
+            if row:
+                article_id = row[0]
+                changed = conn.execute(
+                    "UPDATE articles SET body = ? WHERE id = ? AND LENGTH(?) > LENGTH(body)",
+                    (a.get("body", ""), article_id, a.get("body", "")),
+                ).rowcount
+                conn.execute(
+                    "UPDATE articles SET last_seen = ?, date = CASE WHEN date = '' THEN ? ELSE date END"
+                    " WHERE id = ?",
+                    (now, a.get("date", ""), article_id),
+                )
+                if changed:
+                    conn.execute("DELETE FROM articles_fts WHERE id = ?", (article_id,))
+                    conn.execute(
+                        "INSERT INTO articles_fts (id, title, body, source)"
+                        " SELECT id, title, body, source FROM articles WHERE id = ?",
+                        (article_id,),
+                    )
+            else:
+                article_id = hashlib.sha1((url_key or title_key).encode()).hexdigest()[:16]
+                conn.execute(
+                    "INSERT OR IGNORE INTO articles"
+                    " (id, url_key, title_key, title, url, body, date, source, image, first_seen, last_seen)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (article_id, url_key, title_key, a.get("title", ""), a.get("url", ""), a.get("body", ""),
+                     a.get("date", ""), a.get("source", ""), a.get("image", ""), now, now),
+                )
+                conn.execute(
+                    "INSERT INTO articles_fts (id, title, body, source) VALUES (?, ?, ?, ?)",
+                    (article_id, a.get("title", ""), a.get("body", ""), a.get("source", "")),
+                )
+            conn.execute(
+                "INSERT OR REPLACE INTO article_tags (id, symbol, category, lang, seen) VALUES (?, ?, ?, ?, ?)",
+                (article_id, symbol, category, lang, now),
+            )
+        if articles:
+            conn.execute(
+                "INSERT OR REPLACE INTO news_runs (symbol, category, lang, ran_at) VALUES (?, ?, ?, ?)",
+                (symbol, category, lang, now),
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _news_index_lookup(symbol: str, category: str, lang: str, limit: int = NEWS_PAGE_SIZE) -> list[dict] | None:
+    """从本地索引读取文章 (附带分类标签)；该组合最近未采集时返回 None"""
+    conn = _news_db()
+    row = conn.execute(
+        "SELECT ran_at FROM news_runs WHERE symbol = ? AND category = ? AND lang = ?", (symbol, category, lang)
+    ).fetchone()
+    if row is None or time.time() - row[0] > NEWS_INDEX_MAX_AGE:
+        return None
+
+    rows = conn.execute(
+        "SELECT a.id, a.title, a.url, a.body, a.date, a.source, a.image"
+        " FROM article_tags t JOIN articles a ON a.id = t.id"
+        " WHERE t.symbol = ? AND t.category = ? AND t.lang = ?"
+        " ORDER BY t.seen DESC, a.date DESC LIMIT ?",
+        (symbol, category, lang, limit),
+    ).fetchall()
+    ids = [r[0] for r in rows]
+    tags: dict[str, list[str]] = {}
+    if ids:
+        placeholders = ",".join("?" * len(ids))
+        for article_id, tag in conn.execute(
+            f"SELECT DISTINCT id, category FROM article_tags WHERE symbol = ? AND id IN ({placeholders})",
+            (symbol, *ids),
+        ):
+            tags.setdefault(article_id, []).append(tag)
+
+    return [{
+        "title": title,
+        "url": url,
+        "body": body,
+        "date": date,
+        "source": source,
+        "image": image,
+        "categories": sorted(tags.get(article_id, [])),
+    } for article_id, title, url, body, date, source, image in rows]
+
+
+def _fts_query(q: str) -> str:
+    """把用户输入转换为 FTS5 查询：每个词作为短语加引号 (隐式 AND)，避免语法错误"""
+    terms = [t.replace('"', '""') for t in q.split()]
+    return " ".join(f'"{t}"' for t in terms)
+
+
+def _news_index_search(q: str, symbol: str = "", category: str = "", since: float | None = None,
+                       page: int = 1, page_size: int = NEWS_PAGE_SIZE) -> dict:
+    """在本地新闻索引中全文检索，按 BM25 相关度排序 (标题权重最高) 并分页"""
+    where, params = ["articles_fts MATCH ?"], [_fts_query(q)]
+    if symbol or category:
+        tag_where, tag_params = [], []
+        if symbol:
+            tag_where.append("t.symbol = ?")
+            tag_params.append(symbol)
+        if category:
+            tag_where.append("t.category = ?")
+            tag_params.append(category)
+        where.append(f"a.id IN (SELECT t.id FROM article_tags t WHERE {' AND '.join(tag_where)})")
+        params += tag_params
+    if since is not None:
+        where.append("a.first_seen >= ?")
+        params.append(since)
+
+    conn = _news_db()
+    sql_from = f" FROM articles_fts JOIN articles a ON a.id = articles_fts.id WHERE {' AND '.join(where)}"
+    total = conn.execute("SELECT COUNT(*)" + sql_from, params).fetchone()[0]
+    rows = conn.execute(
+        "SELECT a.id, a.title, a.url, a.body, a.date, a.source, a.image, bm25(articles_fts, 0, 10.0, 1.0, 2.0)"
+        + sql_from + " ORDER BY 8, a.first_seen DESC LIMIT ? OFFSET ?",
+        (*params, page_size, (page - 1) * page_size),
+    ).fetchall()
+
+    tags: dict[str, list[dict]] = {}
+    ids = [r[0] for r in rows]
+    if ids:
+        placeholders = ",".join("?" * len(ids))
+        for article_id, sym, cat in conn.execute(
+            f"SELECT DISTINCT id, symbol, category FROM article_tags WHERE id IN ({placeholders})", ids
+        ):
+            tags.setdefault(article_id, []).append({"symbol": sym, "category": cat})
+
+    results = [{
+        "title": title,
+        "url": url,
+        "body": body,
+        "date": date,
+        "source": source,
+        "image": image,
+        "score": round(-rank, 4),
+        "tags": tags.get(article_id, []),
+    } for article_id, title, url, body, date, source, image, rank in rows]
+    return {"query": q, "total": total, "page": page, "page_size": page_size, "results": results}
+
+
+_news_demand_marked: dict[tuple[str, str, str], float] = {}
+
+
+def _news_mark_requested(symbol: str, category: str, lang: str):
+    """记录用户查看了该组合 (每个进程每组合最多每 5 分钟写一次数据库)"""
+    if symbol not in METAL_NAMES or lang not in NEWS_LANGS:
+        return
+    key = (symbol, category, lang)
+    now = time.time()
+    if now - _news_demand_marked.get(key, 0) < 300:
+        return
+    _news_demand_marked[key] = now
+    try:
+        _news_db().execute(
+            "INSERT OR REPLACE INTO news_demand (symbol, category, lang, requested_at) VALUES (?, ?, ?, ?)",
+            (*key, now),
+        )
+    except sqlite3.Error as e:
+        logger.warning(f"News demand write failed for {symbol}/{category}/{lang}: {e}")
+
+
+def _news_ingest_jobs() -> list[tuple[str, str, str, str]]:
+    """最近有用户查看的 (symbol, name, category, lang)，最近查看的在前，最多 NEWS_INGEST_MAX_QUERIES 个"""
+    rows = _news_db().execute(
+        "SELECT symbol, category, lang FROM news_demand WHERE requested_at >= ? ORDER BY requested_at DESC",
+        (time.time() - NEWS_DEMAND_TTL,),
+    ).fetchall()
+    jobs = [(sym, METAL_NAMES[sym], cat, lang) for sym, cat, lang in rows
+            if sym in METAL_NAMES and cat in METAL_SEARCH_TEMPLATES and lang in NEWS_LANGS]
+    return jobs[:NEWS_INGEST_MAX_QUERIES]
+
+
+def _news_ingester():
+    """后台定期采集用户最近查看过的金属/分类/语言组合的新闻，写入本地索引
+
+    只有持有 worker 租约的进程执行；每轮查询均匀分布在整个周期内。
+    """
+    while True:
+        started = time.time()
+        jobs = []
+        try:
+            if _hold_worker_lease("news-ingest", 2 * NEWS_INGEST_INTERVAL):
+                jobs = _news_ingest_jobs()
+        except sqlite3.Error as e:
+            logger.warning(f"News ingest skipped: {e}")
+        if jobs:
+            spacing = NEWS_INGEST_INTERVAL / len(jobs)
+            for sym, name, cat, lang in jobs:
+                try:
+                    _news_index_store(sym, cat, lang, _search_news(_news_query(name, cat, lang)))
+                except Exception as e:
+                    logger.warning(f"News ingest failed for {sym}/{cat}/{lang}: {e}")
+                time.sleep(spacing)
+            logger.info(f"News ingest finished: {len(jobs)} queries in {time.time() - started:.0f}s")
+        time.sleep(max(0.0, started + NEWS_INGEST_INTERVAL - time.time()))
+
+
+# ---------------------------------------------------------------------------
+#  Routes – News / Information
+# ---------------------------------------------------------------------------
+def _search_news(query: str) -> list[dict]:
+    """DuckDuckGo 新闻搜索，失败时回退到网页搜索"""
+    with _upstream.limit("ddgs"), _timed("ddgs"):
+        return _search_news_unlimited(query)
+
+
+def _search_news_unlimited(query: str) -> list[dict]:
+    if NEWS_SEARCH_URL:
+        resp = _upstream.get("ddgs", NEWS_SEARCH_URL, params={"q": query, "max_results": 12}, timeout=15)
+        resp.raise_for_status()
+        return [{
+            "title": r.get("title", ""),
+            "url": r.get("url", ""),
+            "body": r.get("body", ""),
+            "date": r.get("date", ""),
+            "source": r.get("source", ""),
+            "image": r.get("image", ""),
+        } for r in resp.json()]
 
     articles = []
     try:
         with DDGS() as ddgs:
+            _faults.before_call("ddgs", timeout=5)
             results = list(ddgs.news(query, max_results=12))
             for r in results:
                 articles.append({
@@ -502,8 +2940,10 @@ def get_news(symbol: str):
                 })
     except Exception as e:
         logger.warning("DuckDuckGo news error: %s – falling back to text search", e)
+        _m_retries.inc(upstream="ddgs", reason="text_fallback")
         try:
             with DDGS() as ddgs:
+                _faults.before_call("ddgs", timeout=5)
                 results = list(ddgs.text(query, max_results=12))
                 for r in results:
                     articles.append({
@@ -516,22 +2956,444 @@ def get_news(symbol: str):
                     })
         except Exception as e2:
             logger.error("Text search also failed: %s", e2)
+    return articles
+
+
+def _load_news(symbol: str, category: str, lang: str, metal_name: str) -> dict:
+    """优先读取本地新闻索引；该组合尚未采集时实时搜索并写入索引"""
+    articles = _news_index_lookup(symbol, category, lang)
+    if articles is None:
+        found = _search_news(_news_query(metal_name, category, lang))
+        try:
+            _news_index_store(symbol, category, lang, found)
+            articles = _news_index_lookup(symbol, category, lang)
+        except Exception as e:
+            logger.warning(f"News index write failed for {symbol}: {e}")
+        if articles is None:
+            articles = found
+    return {"symbol": symbol, "category": category, "articles": articles}
+
+
+@app.route("/api/news/search")
+def search_news():
+    """Full-text search over every article in the local news index.
+
+    Query: ``q`` (required), optional ``symbol``, ``category``, ``since``
+    (ISO date/time or days back, e.g. ``7``), ``page`` and ``page_size``.
+    """
+    q = request.args.get("q", "").strip()
+    if not q:
+        return jsonify({"error": "Missing search query (q)."}), 400
+
+    since_arg = request.args.get("since", "").strip()
+    since = None
+    if since_arg:
+        try:
+            if since_arg.isdigit():
+                since = time.time() - int(since_arg) * 86400
+            else:
+                since_dt = datetime.fromisoformat(since_arg)
+                if since_dt.tzinfo is None:
+                    since_dt = since_dt.replace(tzinfo=timezone.utc)
+                since = since_dt.timestamp()
+        except (ValueError, OverflowError):
+            return jsonify({"error": f"Invalid since: {since_arg}"}), 400
 
-    result = {"symbol": symbol, "category": category, "articles": articles}
-    _cache_set(cache_key, result)
+    try:
+        page = min(NEWS_SEARCH_MAX_PAGE, max(1, int(request.args.get("page", 1))))
+        page_size = min(50, max(1, int(request.args.get("page_size", NEWS_PAGE_SIZE))))
+    except ValueError:
+        return jsonify({"error": "page and page_size must be integers."}), 400
+
+    start = time.perf_counter()
+    result = _news_index_search(
+        q,
+        symbol=request.args.get("symbol", "").strip(),
+        category=request.args.get("category", "").strip(),
+        since=since,
+        page=page,
+        page_size=page_size,
+    )
+    result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return jsonify(result)
+
+
+@app.route("/api/news/<symbol>")
+def get_news(symbol: str):
+    """Fetch categorised news for a metal element (served from the local news index)."""
+    category = request.args.get("category", "news")
+    if category not in METAL_SEARCH_TEMPLATES:
+        category = "news"
+    lang = request.args.get("lang", "en")
+    metal_name = request.args.get("name", METAL_NAMES.get(symbol, symbol))
+
+    _news_mark_requested(symbol, category, lang)
+    cache_key = f"news:{symbol}:{category}:{lang}"
+    result = _cache_fetch(cache_key, lambda: _load_news(symbol, category, lang, metal_name))
     return jsonify(result)
 
 
+# ---------------------------------------------------------------------------
+#  Prefetch
+# ---------------------------------------------------------------------------
+_prefetch_stats = {"cycles": 0, "refreshed": 0, "fresh": 0, "failed": 0, "last_cycle": None, "next_cycle": None}
+_prefetch_lock = threading.Lock()
+
+
+def _market_open(now: datetime | None = None) -> bool:
+    """CME Globex 金属期货交易时段: 美东时间周日 18:00 至周五 17:00，每日 17:00-18:00 休市 (不含节假日)"""
+    t = (now or datetime.now(timezone.utc)).astimezone(MARKET_TZ)
+    if t.weekday() == 5:
+        return False
+    if t.weekday() == 6:
+        return t.hour >= 18
+    if t.weekday() == 4:
+        return t.hour < 17
+    return t.hour != 17
+
+
+def _prefetch_delay(now: float) -> float:
+    """距下一轮预取的秒数: 对齐到周期整数倍；
+    休市期间若先到开盘时间，则在开盘时立即刷新"""
+    if _market_open(datetime.fromtimestamp(now, timezone.utc)):
+        return PREFETCH_INTERVAL - now % PREFETCH_INTERVAL
+    delay = PREFETCH_CLOSED_INTERVAL - now % PREFETCH_CLOSED_INTERVAL
+    hour = now - now % 3600 + 3600
+    while hour < now + delay:
+        if _market_open(datetime.fromtimestamp(hour, timezone.utc)):
+            return hour - now
+        hour += 3600
+    return delay
+
+
+def _prefetch_jobs() -> list[tuple[str, object, object]]:
+    """(缓存键, 加载函数, accept)；价格在前，新闻在后"""
+    jobs = []
+    for sym in INSTRUMENTS:
+        jobs.append((f"price:{sym}", lambda sym=sym: _load_price(sym), lambda r: r.get("available", False)))
+    for sym, name in METAL_NAMES.items():
+        for lang in NEWS_LANGS:
+            jobs.append((f"news:{sym}:news:{lang}", lambda sym=sym, name=name, lang=lang: _load_news(sym, "news", lang, name), None))
+    return jobs
+
+
+def _prefetcher():
+    """后台定期预取所有金属的价格与默认分类新闻，使用户请求都命中缓存
+
+    每轮只刷新到下一轮之前会软过期的条目；各请求以随机间隔错开，避免集中请求上游。
+    只有持有 worker 租约的进程执行，上游请求量不随 worker 数增加。
+    """
+    time.sleep(random.uniform(0, 2))
+    while True:
+        started = time.time()
+        interval = PREFETCH_INTERVAL if _market_open() else PREFETCH_CLOSED_INTERVAL
+        try:
+            leader = _hold_worker_lease("prefetch", 2 * max(PREFETCH_INTERVAL, PREFETCH_CLOSED_INTERVAL))
+        except sqlite3.Error as e:
+            logger.warning(f"Prefetch skipped: {e}")
+            leader = False
+        if leader:
+            jobs = _prefetch_jobs()
+            spacing = interval * PREFETCH_SPREAD / len(jobs)
+            counts = {"refreshed": 0, "fresh": 0, "failed": 0}
+            for key, loader, accept in jobs:
+                # 只刷新在下一轮之前会软过期的条目
+                min_age = max(0.0, _cache_policy(key)[0] - interval)
+                try:
+                    counts["refreshed" if _cache_prefetch(key, loader, accept, min_age) else "fresh"] += 1
+                except Exception as e:
+                    counts["failed"] += 1
+                    logger.warning(f"Prefetch failed for {key}: {e}")
+                time.sleep(spacing * random.uniform(0.5, 1.5))
+            with _prefetch_lock:
+                _prefetch_stats["cycles"] += 1
+                for k, v in counts.items():
+                    _prefetch_stats[k] += v
+                _prefetch_stats["last_cycle"] = datetime.fromtimestamp(started, timezone.utc).isoformat(timespec="seconds")
+            logger.info(f"Prefetch cycle: {counts['refreshed']} refreshed, {counts['fresh']} fresh, "
+                        f"{counts['failed']} failed in {time.time() - started:.0f}s")
+        delay = _prefetch_delay(time.time())
+        with _prefetch_lock:
+            _prefetch_stats["next_cycle"] = datetime.fromtimestamp(time.time() + delay, timezone.utc).isoformat(timespec="seconds")
+        time.sleep(delay)
+
+
+def _prefetch_snapshot() -> dict:
+    with _prefetch_lock:
+        return {"enabled": PREFETCH_ENABLED, "market_open": _market_open(), **_prefetch_stats}
+
+
 # ---------------------------------------------------------------------------
 #  Helpers – LLM client
 # ---------------------------------------------------------------------------
+LLM_KEEPALIVE_EXPIRY = 120  # 空闲长连接保留秒数，覆盖用户连续对话的间隔
+
+
+class LLMClientPool:
+    """按 (base_url, api_key) 复用的 OpenAI 客户端
+
+    每个客户端持有自己的 httpx 长连接池，后续请求复用已建立的 TLS 连接；
+    通过 httpx trace 事件统计新建连接数，以此得出连接复用率。
+    """
+
+    def __init__(self, max_connections: int):
+        self.max_connections = max_connections
+        self._clients: dict[tuple[str, str], OpenAI] = {}
+        self._lock = threading.Lock()
+        self._stats = {"clients_created": 0, "requests": 0, "new_connections": 0}
+        self._pid = None
+
+    def _count(self, field: str):
+        with self._lock:
+            self._stats[field] += 1
+
+    def _trace(self, event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            self._count("new_connections")
+
+    def _on_request(self, req: httpx.Request):
+        self._count("requests")
+        req.extensions["trace"] = self._trace
+
+    def get(self, base_url: str, api_key: str) -> OpenAI:
+        key = (base_url, api_key)
+        with self._lock:
+            if self._pid != os.getpid():
+                # fork 后不能复用父进程的连接
+                self._clients, self._pid = {}, os.getpid()
+            client = self._clients.get(key)
+            if client is None:
+                transport = httpx.HTTPTransport(
+                    limits=httpx.Limits(
+                        max_connections=self.max_connections,
+                        max_keepalive_connections=self.max_connections,
+                        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+                    ),
+                )
+                http_client = httpx.Client(
+                    transport=FaultTransport("llm", transport),
+                    event_hooks={"request": [self._on_request]},
+                )
+                # 429 退避由 _llm_call / _llm_stream_events 统一处理
+                client = OpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+                self._clients[key] = client
+                self._stats["clients_created"] += 1
+            return client
+
+    def retain(self, base_url: str, api_key: str):
+        """设置变更后丢弃其它客户端；进行中的流持有引用，结束后其连接池随之回收"""
+        with self._lock:
+            self._clients = {k: c for k, c in self._clients.items() if k == (base_url, api_key)}
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["clients"] = len(self._clients)
+        reused = stats["requests"] - stats["new_connections"]
+        stats["reuse_ratio"] = round(reused / stats["requests"], 4) if stats["requests"] else 0.0
+        return stats
+
+
+_llm_clients = LLMClientPool(UPSTREAM_LIMITS["llm"])
+
+
+class LLMBusy(Exception):
+    """LLM 队列已满或排队超时"""
+
+
+class LLMGate:
+    """LLM 调用的并发闸门
+
+    进程内按先来先服务排队 (队列有界，超出直接拒绝)，排队期间可逐步报告位置；
+    队首还需取得一个跨 worker 共享的槽位 (仅 SQLite 缓存后端生效)。
+    任一调用收到 429 时整个闸门暂停到 retry-after 指定的时间。
+    """
+
+    def __init__(self, limit: int, max_waiting: int, shared_limit: int):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.shared_limit = shared_limit
+        self._cond = threading.Condition()
+        self._waiting: deque = deque()
+        self._active = 0
+        self._paused_until = 0.0
+        self._stats = {"admitted": 0, "rejected": 0, "timeouts": 0, "rate_limited": 0}
+
+    def _claim_shared(self) -> int | None:
+        if self.shared_limit <= 0:
+            return -1
+        for i in range(self.shared_limit):
+            if _cache.try_lease(f"llm-slot:{i}", LLM_SLOT_TTL):
+                return i
+        return None
+
+    def wait(self):
+        """排队直到获得执行权；生成器，每当排队位置变化时 yield 位置 (从 1 开始)，返回槽位"""
+        ticket = object()
+        with self._cond:
+            if len(self._waiting) >= self.max_waiting:
+                self._stats["rejected"] += 1
+                raise LLMBusy("AI service is busy, please try again shortly.")
+            self._waiting.append(ticket)
+        deadline = time.time() + LLM_QUEUE_TIMEOUT
+        reported = None
+        try:
+            while True:
+                with self._cond:
+                    position = self._waiting.index(ticket) + 1
+                    if position == 1 and self._active < self.limit and time.time() >= self._paused_until:
+                        slot = self._claim_shared()
+                        if slot is not None:
+                            self._waiting.popleft()
+                            self._active += 1
+                            self._stats["admitted"] += 1
+                            self._cond.notify_all()
+                            return slot
+                    if time.time() >= deadline:
+                        self._stats["timeouts"] += 1
+                        raise LLMBusy("Timed out waiting for the AI service, please try again.")
+                    if position == reported:
+                        self._cond.wait(timeout=0.5)
+                        continue
+                # 在锁外 yield，避免客户端写入阻塞其它排队者
+                reported = position
+                yield position
+        finally:
+            with self._cond:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    self._cond.notify_all()
+
+    def release(self, slot: int):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+        if slot >= 0:
+            _cache.release(f"llm-slot:{slot}")
+
+    def pause(self, seconds: float):
+        with self._cond:
+            self._stats["rate_limited"] += 1
+            self._paused_until = max(self._paused_until, time.time() + seconds)
+
+    @contextmanager
+    def slot(self):
+        """非流式调用：阻塞排队直到获得执行权"""
+        waiter = self.wait()
+        while True:
+            try:
+                next(waiter)
+            except StopIteration as done:
+                slot = done.value
+                break
+        try:
+            yield
+        finally:
+            self.release(slot)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "shared_limit": self.shared_limit,
+                "active": self._active,
+                "waiting": len(self._waiting),
+                "paused_for": round(max(0.0, self._paused_until - time.time()), 1),
+                **self._stats,
+            }
+
+
+_llm_gate = LLMGate(UPSTREAM_LIMITS["llm"], LLM_QUEUE_MAX, LLM_SHARED_CONCURRENCY)
+
+
 def _get_llm_client() -> OpenAI | None:
     if not llm_settings.get("api_key"):
         return None
-    return OpenAI(
-        api_key=llm_settings["api_key"],
-        base_url=llm_settings.get("base_url", "https://api.openai.com/v1"),
-    )
+    return _llm_clients.get(llm_settings.get("base_url", "https://api.openai.com/v1"), llm_settings["api_key"])
+
+
+def _retry_after(e: RateLimitError, attempt: int) -> float:
+    """根据 429 响应头 (retry-after-ms / retry-after / x-ratelimit-reset-requests) 计算退避秒数"""
+    headers = e.response.headers if getattr(e, "response", None) is not None else {}
+    delay = None
+    try:
+        if headers.get("retry-after-ms"):
+            delay = float(headers["retry-after-ms"]) / 1000
+        elif headers.get("retry-after"):
+            value = headers["retry-after"]
+            try:
+                delay = float(value)
+            except ValueError:
+                delay = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        elif headers.get("x-ratelimit-reset-requests", "").endswith("s"):
+            delay = float(headers["x-ratelimit-reset-requests"].rstrip("s"))
+    except (TypeError, ValueError):
+        delay = None
+    if delay is None or delay <= 0:
+        delay = 2 ** attempt + random.uniform(0, 1)
+    return min(delay, LLM_MAX_BACKOFF)
+
+
+def _llm_call(create):
+    """非流式调用 LLM，遇到 429 时暂停闸门并按响应头退避重试"""
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            with _upstream.limit("llm"), _timed("llm"):
+                return create()
+        except RateLimitError as e:
+            if attempt == LLM_MAX_RETRIES:
+                raise
+            delay = _retry_after(e, attempt)
+            logger.warning(f"LLM rate limited, retrying in {delay:.1f}s")
+            _m_retries.inc(upstream="llm", reason="rate_limited")
+            _llm_gate.pause(delay)
+            time.sleep(delay)
+
+
+def _llm_stream_events(client: OpenAI, messages: list[dict], endpoint: str = "chat"):
+    """排队并流式调用 LLM，逐个产出 SSE 事件负载
+
+    排队期间产出 ``{"queue": {"position": n}}``，遇到 429 时产出
+    ``{"retry": {"after": s}}`` 后退避重试，之后产出 ``{"content": ...}``。
+    """
+    waiter = _llm_gate.wait()
+    while True:
+        try:
+            yield {"queue": {"position": next(waiter)}}
+        except StopIteration as done:
+            slot = done.value
+            break
+    try:
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            try:
+                with _upstream.limit("llm"), _timed("llm"):
+                    start = time.perf_counter()
+                    first = True
+                    stream = client.chat.completions.create(
+                        model=llm_settings["model"],
+                        temperature=llm_settings["temperature"],
+                        messages=messages,
+                        stream=True,
+                    )
+                    for chunk in stream:
+                        delta = chunk.choices[0].delta if chunk.choices else None
+                        if delta and delta.content:
+                            if first:
+                                _m_llm_ttft.observe(time.perf_counter() - start, endpoint=endpoint)
+                                first = False
+                            yield {"content": delta.content}
+                return
+            except RateLimitError as e:
+                if attempt == LLM_MAX_RETRIES:
+                    raise
+                delay = _retry_after(e, attempt)
+                logger.warning(f"LLM rate limited, retrying in {delay:.1f}s")
+                _m_retries.inc(upstream="llm", reason="rate_limited")
+                _llm_gate.pause(delay)
+                yield {"retry": {"after": round(delay, 1)}}
+                time.sleep(delay)
+    finally:
+        _llm_gate.release(slot)
 
 
 SYSTEM_PROMPT_ZH = (
@@ -546,6 +3408,181 @@ SYSTEM_PROMPT_EN = (
 )
 
 
+# ---------------------------------------------------------------------------
+#  Helpers – Prompt packing
+# ---------------------------------------------------------------------------
+_CJK_RE = re.compile(r"[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]")
+_SENTENCE_RE = re.compile(r"(?<=[.!?。！？])\s*")
+MESSAGE_TOKEN_OVERHEAD = 4
+
+
+def _count_tokens(text: str) -> int:
+    """估算 token 数：中日韩字符按 1 个计，其余按每 4 个字符 1 个计"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _truncate_tokens(text: str, budget: int) -> str:
+    """截断文本使其不超过 budget 个 token (保留开头)"""
+    if _count_tokens(text) <= budget:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if _count_tokens(text[:mid]) < budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo].rstrip() + "…"
+
+
+def _prompt_budget() -> int:
+    return int(LLM_PROMPT_BUDGETS.get(llm_settings["model"], LLM_PROMPT_BUDGET))
+
+
+def _pack_articles(articles: list[dict], budget: int) -> str:
+    """合并文章正文：去掉重复文章和跨文章重复的句子，再平均分配 token 预算"""
+    seen_titles, seen_sentences, packed = set(), set(), []
+    for a in articles:
+        title = a.get("title", "")
+        title_key = _news_title_key(title)
+        if title_key and title_key in seen_titles:
+            continue
+        seen_titles.add(title_key)
+        sentences = []
+        for sentence in _SENTENCE_RE.split(a.get("body", "")):
+            key = _news_title_key(sentence)
+            if key and key not in seen_sentences:
+                seen_sentences.add(key)
+                sentences.append(sentence)
+        packed.append((title, " ".join(sentences)))
+
+    if not packed:
+        return ""
+    # 标题完整保留，正文按篇平分剩余预算；短文未用完的额度留给后面的文章
+    remaining = budget - sum(_count_tokens(f"**{t}**\n") for t, _ in packed)
+    blocks = []
+    for i, (title, body) in enumerate(packed):
+        share = max(0, remaining // (len(packed) - i))
+        body = _truncate_tokens(body, share)
+        remaining -= _count_tokens(body)
+        blocks.append(f"**{title}**\n{body}")
+    return "\n\n".join(blocks)
+
+
+def _pack_chat(sys_prompt: str, context: str, messages: list[dict], budget: int) -> list[dict]:
+    """把对话压缩进 token 预算
+
+    上下文最多占预算的四分之一；最新的一条消息始终保留，其余从新到旧依次加入，
+    放不下的早期轮次压缩为每轮一行的提要附在系统提示词中。
+    """
+    messages = [m for m in messages if isinstance(m, dict) and m.get("content")]
+    if context:
+        sys_prompt += f"\n\nContext data:\n{_truncate_tokens(context, budget // 4)}"
+    remaining = budget - _count_tokens(sys_prompt) - MESSAGE_TOKEN_OVERHEAD
+    total = sum(_count_tokens(str(m["content"])) + MESSAGE_TOKEN_OVERHEAD for m in messages)
+    digest_budget = budget // 8 if total > remaining else 0
+    remaining -= digest_budget
+
+    kept: list[dict] = []
+    for i, m in enumerate(reversed(messages)):
+        content = str(m["content"])
+        if i == 0:
+            content = _truncate_tokens(content, max(remaining - MESSAGE_TOKEN_OVERHEAD, budget // 4))
+        cost = _count_tokens(content) + MESSAGE_TOKEN_OVERHEAD
+        if i > 0 and cost > remaining:
+            break
+        kept.append({"role": m.get("role", "user"), "content": content})
+        remaining -= cost
+    kept.reverse()
+
+    # 提要从最近被丢弃的轮次往前填充
+    lines, remaining = [], remaining + digest_budget - 10
+    for m in reversed(messages[:len(messages) - len(kept)]):
+        line = f"- {m.get('role', 'user')}: {_truncate_tokens(str(m['content']), 30)}"
+        if _count_tokens(line) > remaining:
+            break
+        lines.append(line)
+        remaining -= _count_tokens(line)
+    if lines:
+        sys_prompt += "\n\nEarlier conversation (condensed):\n" + "\n".join(reversed(lines))
+    return [{"role": "system", "content": sys_prompt}] + kept
+
+
+# ---------------------------------------------------------------------------
+#  Helpers – LLM response cache
+# ---------------------------------------------------------------------------
+LLM_REPLAY_CHUNK = 48  # 命中缓存时按该长度分段回放 SSE
+
+_llm_cache_stats = {"hits": 0, "misses": 0}
+
+
+def _llm_cache_key(sys_prompt: str, user_prompt: str) -> str:
+    """按 模型、温度、系统提示词、用户提示词 计算响应缓存键"""
+    fingerprint = json.dumps(
+        [llm_settings.get("base_url"), llm_settings["model"], llm_settings["temperature"], sys_prompt, user_prompt],
+        ensure_ascii=False,
+    )
+    return "llm:" + hashlib.sha256(fingerprint.encode()).hexdigest()
+
+
+def _llm_cache_expiry(symbol: str, category: str, lang: str) -> float:
+    """缓存响应的过期时间：跟随其所依据的新闻缓存条目，新闻刷新后重新生成"""
+    expires = time.time() + LLM_CACHE_TTL
+    if symbol:
+        entry = _cache.get(f"news:{symbol}:{category or 'news'}:{lang}")
+        if entry is not None:
+            expires = min(expires, max(entry[0] + _cache_policy("news:")[0], time.time() + 60))
+    return expires
+
+
+def _llm_cache_get(key: str) -> str | None:
+    entry = _cache.get(key)
+    hit = entry is not None and entry[1].get("expires", 0) > time.time()
+    with _cache_stats_lock:
+        _llm_cache_stats["hits" if hit else "misses"] += 1
+    return entry[1]["text"] if hit else None
+
+
+def _llm_cache_set(key: str, text: str, expires: float):
+    if text:
+        _cache.set(key, time.time(), {"text": text, "expires": expires})
+
+
+def _llm_cache_fetch(key: str, generate, expires: float) -> tuple[str, bool]:
+    """经 _claim_load / _run_load 调用 LLM：并发的相同提示词只请求一次上游
+
+    返回 (输出, 是否由本请求调用上游)。
+    """
+    fut, owner = _claim_load(key)
+    if owner:
+        _run_load(key, lambda: {"text": generate(), "expires": expires}, fut, lambda r: bool(r["text"]))
+    return fut.result()["text"], owner
+
+
+def _sse_await(fut: Future):
+    """等待进行中的相同提示词的流式调用结束后按 SSE 格式回放其输出，等待期间发送心跳注释"""
+    while True:
+        try:
+            text = fut.result(timeout=PRICE_STREAM_KEEPALIVE)["text"]
+            break
+        except FutureTimeout:
+            yield ": keep-alive\n\n"
+        except Exception as e:
+            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            return
+    yield from _sse_replay(text)
+
+
+def _sse_replay(text: str):
+    """把缓存的完整输出按原 SSE 格式分段回放"""
+    for i in range(0, len(text), LLM_REPLAY_CHUNK):
+        yield f"data: {json.dumps({'content': text[i:i + LLM_REPLAY_CHUNK]})}\n\n"
+    yield "data: [DONE]\n\n"
+
+
 # ---------------------------------------------------------------------------
 #  Routes – AI Summarize
 # ---------------------------------------------------------------------------
@@ -564,9 +3601,8 @@ def ai_summarize():
     if not articles:
         return jsonify({"error": "No articles provided."}), 400
 
-    articles_text = "\n\n".join(
-        f"**{a.get('title', '')}**\n{a.get('body', '')}" for a in articles[:10]
-    )
+    # 提示词模板本身约占 100 token，其余预算留给文章
+    articles_text = _pack_articles(articles[:10], _prompt_budget() - 100)
     sys_prompt = SYSTEM_PROMPT_ZH if lang == "zh" else SYSTEM_PROMPT_EN
     user_prompt = (
         f"以下是关于 **{metal}** 的最新资讯，请提取核心要点并生成一份专业摘要，"
@@ -577,16 +3613,29 @@ def ai_summarize():
         f"and industry impact.\n\n{articles_text}"
     )
 
+    cache_key = _llm_cache_key(sys_prompt, user_prompt)
+    cached = _llm_cache_get(cache_key)
+    if cached is not None:
+        return jsonify({"summary": cached, "cached": True})
+    expires = _llm_cache_expiry(data.get("symbol", ""), data.get("category", ""), lang)
+
+    def generate() -> str:
+        with _llm_gate.slot():
+            resp = _llm_call(lambda: client.chat.completions.create(
+                model=llm_settings["model"],
+                temperature=llm_settings["temperature"],
+                messages=[
+                    {"role": "system", "content": sys_prompt},
+                    {"role": "user", "content": user_prompt},
+                ],
+            ))
+        return resp.choices[0].message.content
+
     try:
-        resp = client.chat.completions.create(
-            model=llm_settings["model"],
-            temperature=llm_settings["temperature"],
-            messages=[
-                {"role": "system", "content": sys_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-        )
-        return jsonify({"summary": resp.choices[0].message.content})
+        summary, called = _llm_cache_fetch(cache_key, generate, expires)
+        return jsonify({"summary": summary, "cached": not called})
+    except LLMBusy as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         logger.error("AI summarize error: %s", e)
         return jsonify({"error": str(e)}), 500
@@ -605,11 +3654,19 @@ def ai_analyze():
     data = request.json or {}
     metal = data.get("metal", "unknown metal")
     metal_zh = data.get("metal_zh", metal)
-    price_info = data.get("price_info", "N/A")
-    news_snippets = data.get("news_snippets", "")
+    budget = _prompt_budget()
+    price_info = _truncate_tokens(data.get("price_info", "N/A"), budget // 4)
+    news_snippets = _truncate_tokens(data.get("news_snippets", ""), budget // 2)
     lang = data.get("lang", "en")
 
     sys_prompt = SYSTEM_PROMPT_ZH if lang == "zh" else SYSTEM_PROMPT_EN
+    try:
+        indicators = _indicator_prompt(data.get("symbol", ""))
+    except Exception as e:
+        logger.warning(f"Indicator computation failed: {e}")
+        indicators = ""
+    if indicators:
+        price_info += ("\n\n技术指标:\n" if lang == "zh" else "\n\nTechnical indicators:\n") + indicators
 
     if lang == "zh":
         user_prompt = (
@@ -638,27 +3695,49 @@ def ai_analyze():
             f"6. **Short-Term Outlook**\n"
         )
 
+    cache_key = _llm_cache_key(sys_prompt, user_prompt)
+    cached = _llm_cache_get(cache_key)
+    if cached is not None:
+        return Response(_sse_replay(cached), mimetype="text/event-stream", headers={"X-Cache": "HIT"})
+    expires = _llm_cache_expiry(data.get("symbol", ""), data.get("category", ""), lang)
+
+    # 相同提示词已在生成中：等待其结束后回放，不再请求上游
+    fut, owner = _claim_load(cache_key)
+    if not owner:
+        return Response(stream_with_context(_sse_await(fut)), mimetype="text/event-stream",
+                        headers={"X-Cache": "COALESCED"})
+
     def generate():
+        parts = []
+        complete = False
         try:
-            stream = client.chat.completions.create(
-                model=llm_settings["model"],
-                temperature=llm_settings["temperature"],
-                messages=[
-                    {"role": "system", "content": sys_prompt},
-                    {"role": "user", "content": user_prompt},
-                ],
-                stream=True,
-            )
-            for chunk in stream:
-                delta = chunk.choices[0].delta if chunk.choices else None
-                if delta and delta.content:
-                    yield f"data: {json.dumps({'content': delta.content})}\n\n"
+            messages = [
+                {"role": "system", "content": sys_prompt},
+                {"role": "user", "content": user_prompt},
+            ]
+            for event in _llm_stream_events(client, messages, "analyze"):
+                if "content" in event:
+                    parts.append(event["content"])
+                yield f"data: {json.dumps(event)}\n\n"
+            complete = True
+            # 只缓存完整结束的输出
+            _llm_cache_set(cache_key, "".join(parts), expires)
             yield "data: [DONE]\n\n"
         except Exception as e:
             logger.error("AI analyze stream error: %s", e)
+            fut.set_exception(e)
             yield f"data: {json.dumps({'error': str(e)})}\n\n"
+        finally:
+            # 客户端中途断开时生成器被关闭，同样需要唤醒等待者
+            with _inflight_lock:
+                _inflight.pop(cache_key, None)
+            if not fut.done():
+                if complete:
+                    fut.set_result({"text": "".join(parts), "expires": expires})
+                else:
+                    fut.set_exception(Exception("Analysis was interrupted, please try again."))
 
-    return Response(stream_with_context(generate()), mimetype="text/event-stream")
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers={"X-Cache": "MISS"})
 
 
 # ---------------------------------------------------------------------------
@@ -684,23 +3763,12 @@ def ai_chat():
             sys_prompt += f"\n\n当前用户正在查看 **{metal_zh}（{metal}）** 的信息面板。"
         else:
             sys_prompt += f"\n\nThe user is currently viewing the info panel for **{metal}**."
-    if context:
-        sys_prompt += f"\n\nContext data:\n{context}"
-
-    full_messages = [{"role": "system", "content": sys_prompt}] + messages
+    full_messages = _pack_chat(sys_prompt, context, messages, _prompt_budget())
 
     def generate():
         try:
-            stream = client.chat.completions.create(
-                model=llm_settings["model"],
-                temperature=llm_settings["temperature"],
-                messages=full_messages,
-                stream=True,
-            )
-            for chunk in stream:
-                delta = chunk.choices[0].delta if chunk.choices else None
-                if delta and delta.content:
-                    yield f"data: {json.dumps({'content': delta.content})}\n\n"
+            for event in _llm_stream_events(client, full_messages):
+                yield f"data: {json.dumps(event)}\n\n"
             yield "data: [DONE]\n\n"
         except Exception as e:
             logger.error("AI chat stream error: %s", e)
@@ -727,6 +3795,8 @@ def settings():
         llm_settings["model"] = data["model"]
     if "temperature" in data:
         llm_settings["temperature"] = float(data["temperature"])
+    # 连接相关字段变化时只保留当前配置对应的客户端
+    _llm_clients.retain(llm_settings.get("base_url", "https://api.openai.com/v1"), llm_settings["api_key"])
 
     return jsonify({"status": "ok"})
 
@@ -738,16 +3808,94 @@ def settings():
 def clear_cache():
     symbol = (request.json or {}).get("symbol")
     if symbol:
-        keys_to_del = [k for k in _cache if k.split(":")[1] == symbol]
+        # 共享后端的删除对所有 worker 立即生效
+        keys_to_del = [k for k in _cache.keys() if k.split(":")[1:2] == [symbol]]
+        # 包含该元素的共享条目：所在数据源的批量报价，以及 (有期货日线时) 所有范围的技术指标
+        keys_to_del += [f"quotes:{source}" for source in INSTRUMENTS.get(symbol, {}).get("sources", {})]
+        if symbol in YAHOO_TICKERS:
+            keys_to_del += [f"indicators:{r}" for r in HISTORY_RANGES]
         for k in keys_to_del:
-            del _cache[k]
+            _cache.delete(k)
     else:
         _cache.clear()
     return jsonify({"status": "ok"})
 
 
+@app.route("/metrics")
+def metrics():
+    """Prometheus metrics for this worker process."""
+    lines = []
+    for m in _metrics:
+        lines += m.render()
+
+    with _cache_stats_lock:
+        counters = dict(_cache_stats)
+        llm_counters = dict(_llm_cache_stats)
+    lines += ["# HELP nf_cache_lookups_total Cache lookups by result.", "# TYPE nf_cache_lookups_total counter"]
+    lines += [f'nf_cache_lookups_total{{cache="data",result="{k}"}} {v}' for k, v in counters.items()]
+    lines += [f'nf_cache_lookups_total{{cache="llm",result="{k}"}} {v}' for k, v in llm_counters.items()]
+    lookups = sum(counters.values())
+    hit_ratio = (counters["hits"] + counters["stale_hits"]) / lookups if lookups else 0.0
+    cache = _cache.stats()
+    gauges = {
+        "nf_cache_hit_ratio": ("Fresh or stale cache hits / lookups.", hit_ratio),
+        "nf_cache_entries": ("Entries in the cache backend.", cache.get("entries", 0)),
+        "nf_cache_evictions_total": ("Entries evicted by the size limit.", cache.get("evictions", 0)),
+    }
+    for name, (help_, value) in gauges.items():
+        kind = "counter" if name.endswith("_total") else "gauge"
+        lines += [f"# HELP {name} {help_}", f"# TYPE {name} {kind}", f"{name} {value}"]
+
+    lines += ["# HELP nf_upstream_in_flight Calls currently in flight per upstream.",
+              "# TYPE nf_upstream_in_flight gauge"]
+    lines += [f'nf_upstream_in_flight{{upstream="{k}"}} {v["in_flight"]}' for k, v in _upstream.stats().items()]
+    queue_stats = _llm_gate.stats()
+    lines += ["# HELP nf_llm_queue_waiting LLM requests waiting for a slot.", "# TYPE nf_llm_queue_waiting gauge",
+              f"nf_llm_queue_waiting {queue_stats['waiting']}"]
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/api/cache/stats")
+def cache_stats():
+    """Cache size, eviction and hit/miss counters for this process."""
+    with _cache_stats_lock:
+        counters = dict(_cache_stats)
+        llm_counters = dict(_llm_cache_stats)
+    lookups = sum(counters.values())
+    hit_ratio = (counters["hits"] + counters["stale_hits"]) / lookups if lookups else 0.0
+    return jsonify({
+        "backend": CACHE_BACKEND,
+        **_cache.stats(),
+        **counters,
+        "hit_ratio": round(hit_ratio, 4),
+        "llm": llm_counters,
+        "prefetch": _prefetch_snapshot(),
+    })
+
+
+# ---------------------------------------------------------------------------
+#  Routes – Fault injection (admin)
+# ---------------------------------------------------------------------------
+@app.route("/api/admin/faults", methods=["GET", "POST", "DELETE"])
+def admin_faults():
+    """Inspect or replace this worker's upstream fault injection config."""
+    if not FAULT_ADMIN_TOKEN or request.headers.get("X-Admin-Token") != FAULT_ADMIN_TOKEN:
+        return jsonify({"error": "Not found"}), 404
+    if request.method == "POST":
+        try:
+            _faults.configure(request.get_json(silent=True) or {})
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+    elif request.method == "DELETE":
+        _faults.configure({})
+    return jsonify({"faults": _faults.config(), "pid": os.getpid()})
+
+
 # ---------------------------------------------------------------------------
 #  Main
 # ---------------------------------------------------------------------------
 if __name__ == "__main__":
+    # 调试模式下重载器的父进程不启动后台线程
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_services()
     app.run(debug=True, host="0.0.0.0", port=5003)
@@ -0,0 +1,560 @@
+"""
+Offline benchmark harness for the dashboard backend.
+
+所有上游 (Yahoo chart/spark、Alpha Vantage、新闻搜索、OpenAI 兼容的 LLM 流) 都由本地回放
+服务器提供，响应来自 bench/fixtures 中录制的数据；缺少录制数据时按相同结构生成确定性的模拟数据。
+
+用法:
+    python bench/bench.py                                   # 进程内启动应用并压测全部场景
+    python bench/bench.py -c 32 -d 20 -s price,news         # 并发 32，每个场景 20 秒
+    python bench/bench.py --cache-backend sqlite --json out/sqlite.json
+    python bench/bench.py --upstream-latency 0.2 --token-delay 0.02
+    python bench/bench.py --target http://127.0.0.1:8000    # 压测已启动的服务 (按 --print-env 的环境变量启动)
+    python bench/bench.py record --av-key KEY               # 从真实上游录制 fixtures
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import shlex
+import socket
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+SYMBOLS = ["Au", "Ag", "Cu", "Pt", "Pd", "Al"]
+METAL_NAMES = {"Au": "Gold", "Ag": "Silver", "Cu": "Copper", "Pt": "Platinum", "Pd": "Palladium", "Al": "Aluminium"}
+CATEGORIES = ["news", "mining", "policy", "price", "industry", "supply"]
+SCENARIOS = ["price", "prices", "news", "summarize", "analyze", "chat"]
+RANGE_DAYS = {"5d": 7, "1mo": 31, "3mo": 92, "6mo": 183, "1y": 366, "2y": 731, "5y": 1827}
+
+
+# ---------------------------------------------------------------------------
+#  Fixtures
+# ---------------------------------------------------------------------------
+def _fixture_path(kind: str, name: str) -> str:
+    safe = name.replace("/", "_").replace("=", "_")
+    return os.path.join(FIXTURES, kind, f"{safe}.json")
+
+
+def _load_fixture(kind: str, name: str):
+    try:
+        with open(_fixture_path(kind, name), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _save_fixture(kind: str, name: str, data):
+    path = _fixture_path(kind, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def _synthetic_chart(ticker: str) -> dict:
+    """与 Yahoo v8 chart 结构相同的 5 年日线随机游走 (按代码确定性生成)"""
+    rng = random.Random(zlib.crc32(ticker.encode()))
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    price = rng.uniform(20, 2000)
+    ts, opens, highs, lows, closes, volumes = [], [], [], [], [], []
+    for i in range(RANGE_DAYS["5y"], -1, -1):
+        day = today - timedelta(days=i)
+        if day.weekday() >= 5:
+            continue
+        open_ = price
+        price *= 1 + rng.gauss(0, 0.012)
+        ts.append(int(day.timestamp()))
+        opens.append(round(open_, 2))
+        highs.append(round(max(open_, price) * (1 + abs(rng.gauss(0, 0.004))), 2))
+        lows.append(round(min(open_, price) * (1 - abs(rng.gauss(0, 0.004))), 2))
+        closes.append(round(price, 2))
+        volumes.append(rng.randint(1000, 100000))
+    return {
+        "meta": {"currency": "USD", "symbol": ticker, "regularMarketPrice": closes[-1]},
+        "timestamp": ts,
+        "indicators": {"quote": [{"open": opens, "high": highs, "low": lows, "close": closes, "volume": volumes}]},
+    }
+
+
+def _chart(ticker: str) -> dict:
+    return _load_fixture("yahoo_chart", ticker) or _synthetic_chart(ticker)
+
+
+def _slice_chart(chart: dict, start_ts: float, end_ts: float) -> dict:
+    keep = [i for i, t in enumerate(chart["timestamp"]) if start_ts <= t <= end_ts]
+    quote = chart["indicators"]["quote"][0]
+    return {
+        "meta": chart["meta"],
+        "timestamp": [chart["timestamp"][i] for i in keep],
+        "indicators": {"quote": [{k: [v[i] for i in keep] for k, v in quote.items()}]},
+    }
+
+
+def _spark(chart: dict, start_ts: float, end_ts: float) -> dict:
+    """与 v7 spark 相同：只有收盘价序列，当日最高/最低/成交量在 meta 中"""
+    sliced = _slice_chart(chart, start_ts, end_ts)
+    quote = chart["indicators"]["quote"][0]
+    meta = {**chart["meta"], "chartPreviousClose": quote["close"][-2]}
+    if quote.get("high"):
+        meta.update(regularMarketDayHigh=quote["high"][-1], regularMarketDayLow=quote["low"][-1],
+                    regularMarketVolume=quote["volume"][-1])
+    return {**sliced, "meta": meta, "indicators": {"quote": [{"close": sliced["indicators"]["quote"][0]["close"]}]}}
+
+
+def _av_series(ticker: str) -> dict:
+    recorded = _load_fixture("alpha_vantage", ticker)
+    if recorded:
+        return recorded
+    chart = _synthetic_chart(ticker)
+    q = chart["indicators"]["quote"][0]
+    series = {
+        datetime.fromtimestamp(t, timezone.utc).strftime("%Y-%m-%d"): {
+            "1. open": str(q["open"][i]), "2. high": str(q["high"][i]), "3. low": str(q["low"][i]),
+            "4. close": str(q["close"][i]), "5. volume": str(q["volume"][i]),
+        }
+        for i, t in enumerate(chart["timestamp"])
+    }
+    return {"Meta Data": {"2. Symbol": ticker}, "Time Series (Daily)": dict(reversed(series.items()))}
+
+
+def _news(query: str) -> list[dict]:
+    key = hashlib.sha1(query.encode()).hexdigest()[:12]
+    recorded = _load_fixture("news", key)
+    if recorded:
+        return recorded
+    rng = random.Random(key)
+    words = query.split()
+    return [{
+        "title": f"{' '.join(rng.sample(words, min(3, len(words)))).title()} update #{rng.randint(1, 500)}",
+        "url": f"https://news.example.com/{key}/{i}",
+        "body": " ".join(rng.choice(words) for _ in range(60)) + ".",
+        "date": (datetime.now(timezone.utc) - timedelta(hours=i * 3)).isoformat(),
+        "source": rng.choice(["Reuters", "Bloomberg", "Mining Weekly", "FT"]),
+        "image": "",
+    } for i in range(12)]
+
+
+def _llm_text() -> str:
+    recorded = _load_fixture("llm", "completion")
+    if recorded:
+        return recorded["text"]
+    section = "Prices held steady as supply tightness offset weaker downstream demand. "
+    return "\n\n".join(f"## {i}. Section\n" + section * 6 for i in range(1, 7))
+
+
+# ---------------------------------------------------------------------------
+#  Replay server
+# ---------------------------------------------------------------------------
+class ReplayServer:
+    """本地上游替身：按路径回放 fixtures，统计各类上游调用次数，可注入固定延迟"""
+
+    def __init__(self, latency: float = 0.0, token_delay: float = 0.0, chunk_chars: int = 16):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.chunk_chars = chunk_chars
+        self.counts: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._charts: dict[str, dict] = {}
+        self._llm_text = _llm_text()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name="replay-server", daemon=True).start()
+        return self
+
+    def count(self, kind: str):
+        with self._lock:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self.counts)
+
+    def chart(self, ticker: str) -> dict:
+        if ticker not in self._charts:
+            self._charts[ticker] = _chart(ticker)
+        return self._charts[ticker]
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # 流式响应逐块写出，关闭 Nagle 避免每块等待延迟 ACK
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, data, status: int = 200):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                params = {k: v[0] for k, v in parse_qs(parts.query).items()}
+                if server.latency:
+                    time.sleep(server.latency)
+
+                if parts.path.startswith("/v8/finance/chart/"):
+                    server.count("yahoo_chart")
+                    chart = server.chart(parts.path.rsplit("/", 1)[1])
+                    now = time.time()
+                    if "period1" in params:
+                        start, end = float(params["period1"]), float(params.get("period2", now))
+                    else:
+                        start, end = now - RANGE_DAYS.get(params.get("range", "1mo"), 31) * 86400, now
+                    self._json({"chart": {"result": [_slice_chart(chart, start, end)], "error": None}})
+                elif parts.path == "/v7/finance/spark":
+                    server.count("yahoo_spark")
+                    now = time.time()
+                    result = [{
+                        "symbol": t,
+                        "response": [_spark(server.chart(t), now - 7 * 86400, now)],
+                    } for t in params.get("symbols", "").split(",") if t]
+                    self._json({"spark": {"result": result, "error": None}})
+                elif parts.path == "/query":
+                    server.count("alpha_vantage")
+                    series = _av_series(params.get("symbol", ""))
+                    if params.get("outputsize", "compact") == "compact" and "Time Series (Daily)" in series:
+                        # 与真实接口一致：compact 只返回最近 100 个交易日
+                        days = dict(list(series["Time Series (Daily)"].items())[:100])
+                        series = {**series, "Time Series (Daily)": days}
+                    self._json(series)
+                elif parts.path == "/news":
+                    server.count("news")
+                    self._json(_news(params.get("q", "")))
+                else:
+                    server.count("other")
+                    self._json({})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.endswith("/chat/completions"):
+                    self._json({"error": "not found"}, 404)
+                    return
+                server.count("llm")
+                if server.latency:
+                    time.sleep(server.latency)
+                text = server._llm_text
+                base = {"id": "bench", "created": int(time.time()), "model": body.get("model", "bench")}
+                if not body.get("stream"):
+                    self._json({**base, "object": "chat.completion", "choices": [{
+                        "index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text},
+                    }]})
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                def send(payload: str):
+                    data = f"data: {payload}\n\n".encode()
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                    self.wfile.flush()
+
+                for i in range(0, len(text), server.chunk_chars):
+                    if server.token_delay:
+                        time.sleep(server.token_delay)
+                    send(json.dumps({**base, "object": "chat.completion.chunk", "choices": [{
+                        "index": 0, "finish_reason": None, "delta": {"content": text[i:i + server.chunk_chars]},
+                    }]}))
+                send("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+
+        return Handler
+
+
+def replay_env(replay_url: str) -> dict[str, str]:
+    """让应用把所有上游请求发往回放服务器的环境变量"""
+    return {
+        "YAHOO_BASE_URL": replay_url,
+        "YAHOO_COOKIE_URL": f"{replay_url}/cookie",
+        "AV_BASE_URL": replay_url,
+        "ALPHA_VANTAGE_API_KEY": "bench",
+        "NEWS_SEARCH_URL": f"{replay_url}/news",
+        "LLM_BASE_URL": f"{replay_url}/v1",
+        "LLM_API_KEY": "bench",
+        "LLM_MODEL": "bench",
+        # 后台预取的上游请求会计入各场景的调用次数
+        "PREFETCH_ENABLED": "0",
+    }
+
+
+def start_app(env: dict[str, str], cache_backend: str) -> str:
+    """在本进程中启动应用 (多线程 WSGI 服务器)，返回其地址"""
+    os.environ.update(env)
+    os.environ["CACHE_BACKEND"] = cache_backend
+    os.environ["NF_DATA_DIR"] = tempfile.mkdtemp(prefix="nf-bench-")
+    sys.path.insert(0, ROOT)
+    import logging
+
+    from werkzeug.serving import make_server
+
+    import app as nf_app
+
+    # 价格轮询、新闻采集等后台线程会在压测期间请求上游，只保留缓存清理线程
+    nf_app._background_started = True
+    threading.Thread(target=nf_app._cache_sweeper, name="cache-sweeper", daemon=True).start()
+    logging.getLogger("app").setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, nf_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-app", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+# ---------------------------------------------------------------------------
+#  Load generator
+# ---------------------------------------------------------------------------
+def _request_for(scenario: str, i: int, unique: bool) -> tuple[str, str, dict | None, bool]:
+    """第 i 个请求的 (方法, 路径, JSON 请求体, 是否流式)"""
+    sym = SYMBOLS[i % len(SYMBOLS)]
+    metal = METAL_NAMES[sym] + (f" #{i}" if unique else "")
+    if scenario == "price":
+        return "GET", f"/api/price/{sym}", None, False
+    if scenario == "prices":
+        return "GET", "/api/prices", None, False
+    if scenario == "news":
+        return "GET", f"/api/news/{sym}?category={CATEGORIES[i // len(SYMBOLS) % len(CATEGORIES)]}", None, False
+    if scenario == "summarize":
+        articles = _news(f"{METAL_NAMES[sym]} metal market news today")
+        return "POST", "/api/ai/summarize", {"articles": articles, "metal": metal, "symbol": sym}, False
+    if scenario == "analyze":
+        return "POST", "/api/ai/analyze", {
+            "metal": metal, "symbol": sym, "price_info": "N/A", "news_snippets": "- headline",
+        }, True
+    return "POST", "/api/ai/chat", {
+        "messages": [{"role": "user", "content": f"What drives {metal} prices this week?"}], "metal": metal,
+    }, True
+
+
+def _percentile(sorted_values: list[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+def run_scenario(base_url: str, scenario: str, concurrency: int, duration: float,
+                 max_requests: int, unique: bool) -> dict:
+    latencies, first_bytes, errors = [], [], 0
+    lock = threading.Lock()
+    counter = iter(range(max_requests or 10 ** 9))
+    deadline = time.perf_counter() + duration
+
+    client = httpx.Client(
+        base_url=base_url,
+        timeout=httpx.Timeout(120, connect=5),
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+    )
+
+    def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            method, path, body, streaming = _request_for(scenario, i, unique)
+            start = time.perf_counter()
+            first = None
+            ok = False
+            try:
+                with client.stream(method, path, json=body) as resp:
+                    for chunk in resp.iter_raw():
+                        if first is None and chunk:
+                            first = time.perf_counter() - start
+                    ok = resp.status_code < 400 and (not streaming or first is not None)
+            except httpx.HTTPError:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                    if streaming and first is not None:
+                        first_bytes.append(first)
+                else:
+                    errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    wall = time.perf_counter() - started
+    client.close()
+
+    latencies.sort()
+    first_bytes.sort()
+    result = {
+        "scenario": scenario,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": round(len(latencies) / wall, 1) if wall else 0.0,
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 1),
+    }
+    if first_bytes:
+        result["ttfb_p50_ms"] = round(_percentile(first_bytes, 50) * 1000, 1)
+    return result
+
+
+def print_table(results: list[dict]):
+    columns = ["scenario", "requests", "errors", "throughput", "p50_ms", "p95_ms", "p99_ms", "ttfb_p50_ms", "upstream"]
+    rows = [[str(r.get(c, "")) if c != "upstream" else
+             " ".join(f"{k}={v}" for k, v in sorted(r["upstream"].items())) for c in columns] for r in results]
+    widths = [max(len(c), *(len(row[i]) for row in rows)) for i, c in enumerate(columns)]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(v.ljust(w) for v, w in zip(row, widths)))
+
+
+# ---------------------------------------------------------------------------
+#  Recording
+# ---------------------------------------------------------------------------
+def record(args):
+    """从真实上游录制 fixtures (Yahoo 5 年日线、Alpha Vantage 日线、新闻搜索、一次 LLM 输出)"""
+    sys.path.insert(0, ROOT)
+    import app as nf_app
+
+    headers = {"User-Agent": nf_app.YAHOO_USER_AGENT}
+    with httpx.Client(headers=headers, timeout=20, follow_redirects=True) as client:
+        tickers = {t for spec in nf_app.INSTRUMENTS.values()
+                   for source, t in spec["sources"].items() if source != "alpha_vantage"}
+        for ticker in sorted(tickers):
+            resp = client.get(f"https://query1.finance.yahoo.com/v8/finance/chart/{ticker}",
+                              params={"range": "5y", "interval": "1d"})
+            result = (resp.json().get("chart", {}).get("result") or [None])[0] if resp.status_code == 200 else None
+            if result:
+                _save_fixture("yahoo_chart", ticker, result)
+            print(f"yahoo_chart {ticker}: {'ok' if result else resp.status_code}")
+
+        if args.av_key:
+            for ticker in sorted(set(nf_app._source_tickers("alpha_vantage").values())):
+                data = client.get("https://www.alphavantage.co/query", params={
+                    "function": "TIME_SERIES_DAILY", "symbol": ticker, "outputsize": "full", "apikey": args.av_key,
+                }).json()
+                if "Time Series (Daily)" in data:
+                    _save_fixture("alpha_vantage", ticker, data)
+                print(f"alpha_vantage {ticker}: {'ok' if 'Time Series (Daily)' in data else 'failed'}")
+                time.sleep(12)  # 免费版每分钟 5 次
+
+    for sym, name in METAL_NAMES.items():
+        for category in CATEGORIES:
+            query = nf_app._news_query(name, category, "en")
+            articles = nf_app._search_news_unlimited(query)
+            if articles:
+                _save_fixture("news", hashlib.sha1(query.encode()).hexdigest()[:12], articles)
+            print(f"news {sym}/{category}: {len(articles)} articles")
+
+    if args.llm_key:
+        from openai import OpenAI
+
+        client = OpenAI(api_key=args.llm_key, base_url=args.llm_base_url)
+        resp = client.chat.completions.create(model=args.llm_model, messages=[
+            {"role": "system", "content": nf_app.SYSTEM_PROMPT_EN},
+            {"role": "user", "content": "Provide a comprehensive professional market analysis for **Copper**."},
+        ])
+        _save_fixture("llm", "completion", {"text": resp.choices[0].message.content})
+        print("llm completion: ok")
+
+
+# ---------------------------------------------------------------------------
+#  Main
+# ---------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the metals dashboard backend.")
+    parser.add_argument("command", nargs="?", choices=["run", "record"], default="run")
+    parser.add_argument("-s", "--scenarios", default=",".join(SCENARIOS), help="comma separated: " + ",".join(SCENARIOS))
+    parser.add_argument("-c", "--concurrency", type=int, default=16)
+    parser.add_argument("-d", "--duration", type=float, default=10, help="seconds per scenario")
+    parser.add_argument("-n", "--requests", type=int, default=0, help="max requests per scenario (0 = unlimited)")
+    parser.add_argument("--cache-backend", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument("--target", help="benchmark an already running server instead of starting one")
+    parser.add_argument("--replay-port", type=int, default=0, help="fixed port for the replay server (with --target)")
+    parser.add_argument("--upstream-latency", type=float, default=0.0, help="seconds added to every upstream reply")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed LLM chunks")
+    parser.add_argument("--faults", help='FAULT_INJECTION JSON for the app, e.g. \'{"yahoo": {"error_rate": 0.5}}\'')
+    parser.add_argument("--unique-prompts", action="store_true", help="vary AI prompts so the LLM cache never hits")
+    parser.add_argument("--print-env", action="store_true", help="print env vars pointing a server at the replay server")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--av-key", help="record: Alpha Vantage API key")
+    parser.add_argument("--llm-key", help="record: LLM API key")
+    parser.add_argument("--llm-base-url", default="https://api.openai.com/v1")
+    parser.add_argument("--llm-model", default="gpt-4o")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args)
+        return
+
+    replay = ReplayServer(args.upstream_latency, args.token_delay)
+    if args.replay_port:
+        replay.httpd.server_close()
+        replay.httpd = ThreadingHTTPServer(("127.0.0.1", args.replay_port), replay._handler())
+        replay.url = f"http://127.0.0.1:{args.replay_port}"
+    replay.start()
+    env = replay_env(replay.url)
+    if args.faults:
+        json.loads(args.faults)
+        env["FAULT_INJECTION"] = args.faults
+    if args.print_env:
+        for k, v in env.items():
+            print(f"export {k}={shlex.quote(v)}")
+        if args.target is None:
+            print("Replay server running; press Ctrl+C to stop.")
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                return
+
+    base_url = args.target or start_app(env, args.cache_backend)
+    results = []
+    for scenario in [s.strip() for s in args.scenarios.split(",") if s.strip()]:
+        if scenario not in SCENARIOS:
+            parser.error(f"unknown scenario: {scenario}")
+        before = replay.snapshot()
+        result = run_scenario(base_url, scenario, args.concurrency, args.duration, args.requests, args.unique_prompts)
+        after = replay.snapshot()
+        result["upstream"] = {k: v - before.get(k, 0) for k, v in after.items() if v - before.get(k, 0)}
+        results.append(result)
+        print(f"{scenario}: {result['requests']} ok, {result['errors']} errors, p95 {result['p95_ms']}ms",
+              file=sys.stderr)
+
+    print_table(results)
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "config": {k: v for k, v in vars(args).items() if k not in ("av_key", "llm_key")},
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
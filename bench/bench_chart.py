@@ -0,0 +1,146 @@
+"""
+Micro-benchmarks for decoding Yahoo chart responses.
+
+Compares the per-bar cost of the shared single-pass decoder in ``app``
+(``_chart_result`` + ``_chart_bars``) with the previous per-source loops,
+for 1mo / 1y / 5y daily histories, with the stdlib json parser and, if
+installed, orjson.
+
+    python bench/bench_chart.py
+    python bench/bench_chart.py --bars 22,1260 --repeat 7
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import timeit
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("NF_DATA_DIR", tempfile.mkdtemp(prefix="nf-bench-"))
+
+import httpx  # noqa: E402
+
+import app  # noqa: E402
+from bench import _synthetic_chart  # noqa: E402
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# ---------------------------------------------------------------------------
+#  Previous implementations (reference)
+# ---------------------------------------------------------------------------
+def legacy_history_bars(resp: httpx.Response) -> list[tuple]:
+    """_fetch_yahoo_finance 原有的解析: resp.json() + 逐行 utcfromtimestamp"""
+    data = resp.json()
+    result_data = data.get("chart", {}).get("result", [{}])[0]
+    timestamps = result_data.get("timestamp", [])
+    quotes = result_data.get("indicators", {}).get("quote", [{}])[0]
+    closes = quotes.get("close") or []
+    opens = quotes.get("open", closes)
+    highs = quotes.get("high", closes)
+    lows = quotes.get("low", closes)
+    volumes = quotes.get("volume", [0] * len(closes))
+    bars = []
+    for i, ts in enumerate(timestamps):
+        if closes[i] is None:
+            continue
+        dt = datetime.utcfromtimestamp(ts)
+        bars.append((dt.strftime("%Y-%m-%d"), opens[i], highs[i], lows[i], closes[i], volumes[i]))
+    return bars
+
+
+def legacy_generic_history(resp: httpx.Response) -> list[dict]:
+    """_fetch_generic_yahoo 原有的解析: valid 列表 + 每行每列重新求 quotes.get(..., [0]*n)"""
+    data = resp.json()
+    result_data = data.get("chart", {}).get("result", [{}])[0]
+    timestamps = result_data.get("timestamp", [])
+    quotes = result_data.get("indicators", {}).get("quote", [{}])[0]
+    closes = quotes["close"]
+    valid = [(i, c) for i, c in enumerate(closes) if c is not None]
+    price = closes[valid[-1][0]]
+    history = []
+    for i in range(len(valid)):
+        idx = valid[-(i + 1)][0]
+        dt = datetime.utcfromtimestamp(timestamps[idx])
+        history.append({
+            "date": dt.strftime("%Y-%m-%d"),
+            "open": round(quotes.get("open", [0] * len(closes))[idx] or price, 2),
+            "high": round(quotes.get("high", [0] * len(closes))[idx] or price, 2),
+            "low": round(quotes.get("low", [0] * len(closes))[idx] or price, 2),
+            "close": round(closes[idx], 2),
+            "volume": int(quotes.get("volume", [0] * len(closes))[idx] or 0),
+        })
+    return history
+
+
+# ---------------------------------------------------------------------------
+#  Benchmarks
+# ---------------------------------------------------------------------------
+def _response(n_bars: int) -> httpx.Response:
+    chart = _synthetic_chart("GC=F")
+    for key in ("timestamp",):
+        chart[key] = chart[key][-n_bars:]
+    quote = chart["indicators"]["quote"][0]
+    for key in quote:
+        quote[key] = quote[key][-n_bars:]
+    return httpx.Response(200, content=json.dumps({"chart": {"result": [chart], "error": None}}).encode())
+
+
+def _shared_decoder(loads, cold: bool):
+    def decode(resp: httpx.Response) -> list[tuple]:
+        if cold:
+            app._day_str.cache_clear()
+        saved, app._json_loads = app._json_loads, loads
+        try:
+            return app._chart_bars(app._chart_result(resp))
+        finally:
+            app._json_loads = saved
+    return decode
+
+
+def _cases():
+    cases = [
+        ("legacy history loop (json)", legacy_history_bars),
+        ("legacy generic loop (json)", legacy_generic_history),
+        ("shared decoder, json, cold dates", _shared_decoder(json.loads, True)),
+        ("shared decoder, json", _shared_decoder(json.loads, False)),
+    ]
+    if orjson is not None:
+        cases += [
+            ("shared decoder, orjson, cold dates", _shared_decoder(orjson.loads, True)),
+            ("shared decoder, orjson", _shared_decoder(orjson.loads, False)),
+            ("orjson parse only", lambda resp: orjson.loads(resp.content)),
+        ]
+    cases.append(("json parse only", lambda resp: json.loads(resp.content)))
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-bar cost of Yahoo chart decoding.")
+    parser.add_argument("--bars", default="22,252,1260", help="comma separated history lengths")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"orjson: {'available' if orjson else 'not installed'}")
+    print(f"{'case':<38}" + "".join(f"{n:>12} bars" for n in map(int, args.bars.split(","))))
+    for name, fn in _cases():
+        row = f"{name:<38}"
+        for n in map(int, args.bars.split(",")):
+            resp = _response(n)
+            timer = timeit.Timer(lambda: fn(resp))
+            loops, _ = timer.autorange()
+            best = min(timer.repeat(args.repeat, loops)) / loops
+            row += f"{best / n * 1e9:>12.0f} ns/bar"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+"""gunicorn 配置: 线程 worker，以及 worker 加载应用后启动后台线程 (预取、新闻采集等)"""
+
+import os
+
+# 价格推送 (/api/stream/prices) 的每个连接会一直占用一个请求线程。使用线程 worker，
+# 打开的页面就不会占满同步 worker。gthread 的心跳由主循环发送，长连接也不会触发 worker 超时重启。
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "32"))
+
+
+def post_worker_init(worker):
+    from app import start_background_services
+
+    start_background_services()
@@ -36,6 +36,8 @@ const I18N = {
         save: "Save",
         no_price: "No live price data available for this metal.",
         loading: "Loading...",
+        llm_queued: "Waiting for the AI service — position {n} in queue...",
+        llm_retry: "AI service rate limited, retrying in {s}s...",
         error_llm: "LLM API not configured. Please go to Settings.",
         open: "Open",
         high: "High",
@@ -86,6 +88,8 @@ const I18N = {
         save: "保存",
         no_price: "该金属暂无实时期货价格数据。",
         loading: "加载中...",
+        llm_queued: "AI 服务繁忙，正在排队 (第 {n} 位)...",
+        llm_retry: "AI 服务请求受限，{s} 秒后重试...",
         error_llm: "LLM API 未配置，请前往设置。",
         open: "开盘",
         high: "最高",
@@ -114,6 +118,13 @@ function t(key) {
     return (I18N[currentLang] && I18N[currentLang][key]) || (I18N.en[key]) || key;
 }
 
+// Queue / retry notice shown while a streaming AI request waits for its turn
+function llmStatusText(json) {
+    if (json.queue) return t("llm_queued").replace("{n}", json.queue.position);
+    if (json.retry) return t("llm_retry").replace("{s}", json.retry.after);
+    return "";
+}
+
 function applyI18n() {
     document.querySelectorAll("[data-i18n]").forEach((el) => {
         const key = el.getAttribute("data-i18n");
@@ -350,6 +361,8 @@ let currentNewsCategory = "news";
 let chatHistory = [];
 let priceChart = null;
 let currentNewsArticles = [];
+let currentPriceData = null;
+let priceStream = null;
 
 // ---------------------------------------------------------------------------
 //  Periodic Table Rendering
@@ -563,66 +576,37 @@ function loadOverview(el) {
     renderApps(el);
 }
 
+// Expand a columnar history payload (parallel arrays, epoch-day offsets) into rows
+function historyRows(h) {
+    return h.day.map((d, i) => ({
+        date: new Date((h.start_day + d) * 86400000).toISOString().slice(0, 10),
+        open: h.open[i],
+        high: h.high[i],
+        low: h.low[i],
+        close: h.close[i],
+        volume: h.volume[i],
+    }));
+}
+
 async function loadPrice(el) {
     const body = document.getElementById("price-body");
     body.innerHTML = '<div class="loader"><div class="spinner"></div></div>';
     document.getElementById("price-source").textContent = "";
 
     try {
-        const resp = await fetch(`/api/price/${el.symbol}`);
+        const resp = await fetch(`/api/price/${el.symbol}?format=columnar`);
         if (!resp.ok) {
             throw new Error(`HTTP ${resp.status}: ${resp.statusText}`);
         }
         const data = await resp.json();
+        if (data.format === "columnar") data.history = historyRows(data.history);
 
         if (data.available) {
-            const changeClass = data.change >= 0 ? "up" : "down";
-            const arrow = data.change >= 0 ? "▲" : "▼";
-            
-            // 显示数据来源
-            let sourceInfo = data.ticker || data.source || "Unknown";
-            if (data.source) {
-                const sourceNames = {
-                    "yahoo_finance": "Yahoo Finance",
-                    "alpha_vantage": "Alpha Vantage",
-                    "metal_etf": "Metal ETF",
-                    "mining_stock": "Mining Stock"
-                };
-                sourceInfo = sourceNames[data.source] || data.source;
-                if (data.ticker) {
-                    sourceInfo += ` (${data.ticker})`;
-                }
-            }
-            
-            body.innerHTML = `
-                <div class="price-display">
-                    <div class="price-main">$${data.price.toLocaleString()}</div>
-                    <div class="price-change ${changeClass}">
-                        <span>${arrow} ${data.change >= 0 ? "+" : ""}${data.change.toFixed(2)} (${data.change_pct >= 0 ? "+" : ""}${data.change_pct.toFixed(2)}%)</span>
-                    </div>
-                    <div class="price-detail">
-                        <div class="price-detail-item">
-                            <span class="price-detail-label">${t("open")}</span>
-                            <span class="price-detail-value">$${data.open.toLocaleString()}</span>
-                        </div>
-                        <div class="price-detail-item">
-                            <span class="price-detail-label">${t("high")}</span>
-                            <span class="price-detail-value">$${data.high.toLocaleString()}</span>
-                        </div>
-                        <div class="price-detail-item">
-                            <span class="price-detail-label">${t("low")}</span>
-                            <span class="price-detail-value">$${data.low.toLocaleString()}</span>
-                        </div>
-                        <div class="price-detail-item">
-                            <span class="price-detail-label">${t("date")}</span>
-                            <span class="price-detail-value">${data.date}</span>
-                        </div>
-                    </div>
-                </div>
-            `;
-            document.getElementById("price-source").textContent = sourceInfo;
+            currentPriceData = data;
+            renderPriceCard(data);
             renderPriceChart(data.history);
         } else {
+            currentPriceData = null;
             // 显示详细的错误信息
             let errorMessage = t("no_price");
             if (data.message) {
@@ -633,12 +617,87 @@ async function loadPrice(el) {
         }
     } catch (err) {
         console.error("Price loading error:", err);
+        currentPriceData = null;
         const errorMessage = `<i class="fas fa-exclamation-triangle"></i>Network error: ${escapeHtml(err.message)}<br><small style="color: var(--text-muted); font-size: 11px;">Try refreshing the page or check your connection.</small>`;
         body.innerHTML = `<div class="no-data">${errorMessage}</div>`;
         clearPriceChart();
     }
 }
 
+const CURRENCY_SIGNS = { USD: "$", CNY: "¥", HKD: "HK$", AUD: "A$", GBP: "£", GBp: "GBp " };
+
+function currencySign(code) {
+    return CURRENCY_SIGNS[code || "USD"] || `${code} `;
+}
+
+function renderPriceCard(data) {
+    const body = document.getElementById("price-body");
+    const cur = currencySign(data.currency);
+    const changeClass = data.change >= 0 ? "up" : "down";
+    const arrow = data.change >= 0 ? "▲" : "▼";
+
+    // 显示数据来源
+    let sourceInfo = data.ticker || data.source || "Unknown";
+    if (data.source) {
+        const sourceNames = {
+            "yahoo_finance": "Yahoo Finance",
+            "alpha_vantage": "Alpha Vantage",
+            "metal_etf": "Metal ETF",
+            "mining_stock": "Mining Stock"
+        };
+        sourceInfo = sourceNames[data.source] || data.source;
+        if (data.ticker) {
+            sourceInfo += ` (${data.ticker})`;
+        }
+    }
+
+    body.innerHTML = `
+        <div class="price-display">
+            <div class="price-main">${cur}${data.price.toLocaleString()}</div>
+            <div class="price-change ${changeClass}">
+                <span>${arrow} ${data.change >= 0 ? "+" : ""}${data.change.toFixed(2)} (${data.change_pct >= 0 ? "+" : ""}${data.change_pct.toFixed(2)}%)</span>
+            </div>
+            <div class="price-detail">
+                <div class="price-detail-item">
+                    <span class="price-detail-label">${t("open")}</span>
+                    <span class="price-detail-value">${cur}${data.open.toLocaleString()}</span>
+                </div>
+                <div class="price-detail-item">
+                    <span class="price-detail-label">${t("high")}</span>
+                    <span class="price-detail-value">${cur}${data.high.toLocaleString()}</span>
+                </div>
+                <div class="price-detail-item">
+                    <span class="price-detail-label">${t("low")}</span>
+                    <span class="price-detail-value">${cur}${data.low.toLocaleString()}</span>
+                </div>
+                <div class="price-detail-item">
+                    <span class="price-detail-label">${t("date")}</span>
+                    <span class="price-detail-value">${data.date}</span>
+                </div>
+            </div>
+        </div>
+    `;
+    document.getElementById("price-source").textContent = sourceInfo;
+}
+
+// 服务端只在价格变化时推送增量，代替客户端轮询
+function connectPriceStream() {
+    if (priceStream || !window.EventSource) return;
+    priceStream = new EventSource("/api/stream/prices");
+    priceStream.onmessage = (event) => {
+        let payload;
+        try { payload = JSON.parse(event.data); } catch { return; }
+        const quote = selectedElement && payload.prices ? payload.prices[selectedElement.symbol] : null;
+        // 只合并同一数据源的报价：降级时的 ETF / 股票报价不能覆盖期货价格卡片
+        if (!quote || !currentPriceData || currentPriceData.symbol !== quote.symbol
+            || currentPriceData.source !== quote.source) return;
+        // 批量报价没有可靠的开/高/低/成交量，只更新价格相关字段
+        const { price, change, change_pct, date } = quote;
+        currentPriceData = { ...currentPriceData, price, change, change_pct, date };
+        renderPriceCard(currentPriceData);
+    };
+}
+
 function renderPriceChart(history) {
     const canvas = document.getElementById("price-chart");
     if (priceChart) { priceChart.destroy(); }
@@ -675,7 +734,7 @@ function renderPriceChart(history) {
                     borderColor: "#1e293b",
                     borderWidth: 1,
                     callbacks: {
-                        label: ctx => `$${ctx.parsed.y.toLocaleString()}`,
+                        label: ctx => `${currencySign(currentPriceData && currentPriceData.currency)}${ctx.parsed.y.toLocaleString()}`,
                     },
                 },
             },
@@ -793,6 +852,8 @@ async function aiSummarize() {
             body: JSON.stringify({
                 articles: currentNewsArticles.slice(0, 10),
                 metal: selectedElement.name_en,
+                symbol: selectedElement.symbol,
+                category: currentNewsCategory,
                 lang: currentLang,
             }),
         });
@@ -839,6 +900,8 @@ async function aiAnalyze() {
                 metal_zh: selectedElement.name_zh,
                 price_info: priceInfo,
                 news_snippets: newsSnippets,
+                symbol: selectedElement.symbol,
+                category: currentNewsCategory,
                 lang: currentLang,
             }),
         });
@@ -860,6 +923,9 @@ async function aiAnalyze() {
                     if (payload === "[DONE]") break;
                     try {
                         const json = JSON.parse(payload);
+                        if ((json.queue || json.retry) && !fullText) {
+                            content.innerHTML = `<p class="llm-status"><i class="fas fa-hourglass-half"></i> ${llmStatusText(json)}</p>`;
+                        }
                         if (json.content) {
                             fullText += json.content;
                             content.innerHTML = marked.parse(fullText);
@@ -950,6 +1016,9 @@ async function sendChat() {
                     if (payload === "[DONE]") break;
                     try {
                         const json = JSON.parse(payload);
+                        if ((json.queue || json.retry) && !fullText) {
+                            mdBody.innerHTML = `<p class="llm-status"><i class="fas fa-hourglass-half"></i> ${llmStatusText(json)}</p>`;
+                        }
                         if (json.content) {
                             fullText += json.content;
                             mdBody.innerHTML = marked.parse(fullText);
@@ -1074,6 +1143,7 @@ document.addEventListener("DOMContentLoaded", () => {
     renderPeriodicTable();
     applyI18n();
     loadSettings();
+    connectPriceStream();
 
     // Language toggle
     document.getElementById("lang-toggle").addEventListener("click", () => {